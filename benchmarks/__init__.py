@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+"""
+Performance benchmarks.
+
+Synthetic catalogs of various sizes are generated with the test factories, and the hot datastore, web and administrative operations are timed against them.  Run with:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json
+
+Results are JSON, so a run can be compared against a stored baseline.
+"""
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import sys
+
+from benchmarks.suite import SIZES, compare, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark One Page Podcast against synthetic catalogs.")
+    parser.add_argument("--sizes", type=int, nargs="+", help=f"Catalog sizes, in episodes. Default: {' '.join(str(size) for size in SIZES)}", default=SIZES)
+    parser.add_argument("--backend", type=str, choices=["json", "journal", "sqlite"], help="Datastore backend. Default 'json'", default="json")
+    parser.add_argument("--repeat", type=int, help="Runs of each benchmark. Default 5", default=5)
+    parser.add_argument("--work-dir", type=str, help="Where to generate catalogs. Default: the system temporary directory.")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file. Default: standard output.")
+    parser.add_argument("--baseline", type=str, help="Compare against the results in this JSON file.")
+    parser.add_argument("--tolerance", type=float, help="Slowdown, as a fraction of the baseline, reported as a regression. Default 0.2", default=0.2)
+
+    args = parser.parse_args()
+    results = run(args.sizes, args.backend, args.repeat, args.work_dir)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is None:
+        return
+
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+
+    for name, before, after, ratio in rows:
+        flag = "  SLOWER" if name in regressions else ""
+        print(f"{name:40} {before * 1000:10.3f}ms {after * 1000:10.3f}ms {ratio:6.2f}x{flag}", file=sys.stderr)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import opp.datastore.files as files
+import opp.datastore.journal as journal
+import opp.datastore.json_file as jsf
+import opp.datastore.sqlite as sqlite
+from opp.podcast import AudioFormat
+
+from pathlib import Path
+
+import tests.factories as factories
+
+"""
+Synthetic catalog generation.
+
+Episodes come from the test factories.  Their audio files are hard links to the small, valid sample files in tests/data, so a catalog of 100k episodes costs directory entries rather than gigabytes.
+"""
+
+
+DATA_DIR = Path(__file__).parent.parent / "tests" / "data"
+
+SAMPLES = {
+    AudioFormat.MP3: DATA_DIR / "speech_32.mp3",
+    AudioFormat.OggVorbis: DATA_DIR / "speech.ogg",
+    AudioFormat.OggOpus: DATA_DIR / "speech_16.opus",
+}
+
+
+def sample_file(audio_format):
+    """Produce the path of the sample audio file for a format."""
+    return SAMPLES[AudioFormat(audio_format)]
+
+
+def place_audio(source, path):
+    """Put a sample file at path, hard linked where possible."""
+
+    try:
+        os.link(source, path)
+    except OSError:
+        shutil.copyfile(source, path)
+
+
+def podcast_data(episode_dir, size):
+    """Produce the JSON podcast data of a catalog with size episodes, placing their audio files in episode_dir."""
+
+    episode_dir.mkdir(parents=True, exist_ok=True)
+
+    channel = dict(factories.ChannelFactory())
+    channel["image"] = None
+
+    episodes = []
+
+    for ep in factories.EpisodeFactory.create_batch(size):
+        source = sample_file(ep.audio_format)
+        path = files.audio_file_path(episode_dir, str(ep.guid), ep.audio_format.value)
+        place_audio(source, path)
+
+        episodes.append({
+            "title": ep.title,
+            "description": ep.description,
+            "guid": str(ep.guid),
+            "duration": ep.duration,
+            "publication_date": ep.publication_date.isoformat(),
+            "audio_format": ep.audio_format.value,
+            "path": str(path),
+            "length": source.stat().st_size,
+        })
+
+    episodes.sort(key=lambda ep: ep["publication_date"], reverse=True)
+
+    return {"channel": channel, "episodes": episodes}
+
+
+def build_catalog(data_dir, size, backend="json"):
+    """
+    Write a catalog of size episodes into data_dir, for the named backend: json, journal or sqlite.
+
+    Return: the podcast data that was written
+    """
+
+    data = podcast_data(data_dir / jsf.EPISODE_DIR, size)
+
+    if backend == "journal":
+        journal_dir = data_dir / journal.JOURNAL_DIR
+        journal_dir.mkdir(parents=True, exist_ok=True)
+
+        files.write_json(journal_dir / journal.snapshot_name(1), data)
+        (journal_dir / journal.journal_name(1)).touch()
+        files.write_text(journal_dir / journal.CURRENT, "1")
+
+        return data
+
+    files.write_json(data_dir / jsf.OPP_JSON, data)
+
+    if backend == "sqlite":
+        sqlite.migrate_json(data_dir)
+
+    return data
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+import opp.administrator as administrator
+import opp.config as config
+import opp.web.app as web
+
+from pathlib import Path
+
+from benchmarks.catalog import build_catalog, sample_file
+from opp.podcast import AudioFormat
+
+"""
+The benchmarked operations, and the comparison of results against a baseline.
+"""
+
+
+SIZES = [10, 1000, 10000, 100000]
+
+
+def measure(operation, repeat, setup=None):
+    """
+    Time repeat calls of operation, calling setup (untimed) before each.
+
+    Return: dict of timing statistics, in seconds
+    """
+
+    timings = []
+
+    for i in range(repeat):
+
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "runs": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+    }
+
+
+def web_client(data_dir):
+    """Produce a new app serving the datastore in data_dir, and a Flask test client for it."""
+
+    os.environ["OPP"] = str(data_dir)
+    os.environ["OPP_RELOAD_INTERVAL"] = "0"
+
+    app = web.create_app()
+    app.config["TESTING"] = True
+
+    return app, app.test_client()
+
+
+def get(client, url):
+    """Request url, failing loudly rather than timing an error page."""
+
+    response = client.get(url)
+    response.get_data()
+
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} answered {response.status_code}")
+
+
+def benchmark_catalog(data_dir, data, backend, repeat):
+    """Time the hot operations against the catalog in data_dir."""
+
+    results = {}
+    module = config.backend(backend)
+    guids = [ep["guid"] for ep in data["episodes"]]
+
+    results["visitor_load"] = measure(lambda: module.VisitorDS(data_dir, check_interval=0).get_episodes(limit=1), repeat)
+
+    visitor_ds = module.VisitorDS(data_dir)
+    lookups = random.choices(guids, k=1000)
+    results["get_episode_x1000"] = measure(lambda: [visitor_ds.get_episode(guid) for guid in lookups], repeat)
+
+    os.environ["OPP_BACKEND"] = backend
+    app, client = web_client(data_dir)
+    app_state = web.state(app)
+
+    results["home_cold"] = measure(lambda: get(client, "/"), repeat, setup=app_state.clear)
+    results["home_warm"] = measure(lambda: get(client, "/"), repeat)
+    results["rss_cold"] = measure(lambda: get(client, "/rss.xml"), repeat, setup=app_state.clear)
+    results["rss_warm"] = measure(lambda: get(client, "/rss.xml"), repeat)
+
+    episode = random.choice(data["episodes"])
+    url = f"/episode/{episode['guid']}.{web.download_extension(episode['audio_format'])}"
+    results["episode_download"] = measure(lambda: get(client, url), repeat)
+
+    admin_ds = module.AdminDS(data_dir)
+    created = []
+
+    def create():
+        guid = f"00000000-0000-4000-8000-{len(created):012d}"
+
+        with open(sample_file(AudioFormat.MP3), "rb") as file:
+            admin_ds.create_episode(file, "Benchmark", "Benchmark episode", guid, 11, date.today(), AudioFormat.MP3.value, 0)
+
+        created.append(guid)
+
+    results["admin_create_episode"] = measure(create, repeat)
+    results["admin_update_episode"] = measure(lambda: admin_ds.update_episode(random.choice(guids), title="Benchmarked"), repeat)
+    results["admin_delete_episode"] = measure(lambda: admin_ds.delete_episode(created.pop()), repeat)
+
+    return results
+
+
+def benchmark_extract_details(repeat):
+    """Time tag parsing of each sample audio format."""
+
+    results = {}
+
+    for audio_format in AudioFormat:
+
+        def extract():
+            with open(sample_file(audio_format), "rb") as file:
+                administrator.extract_details(file)
+
+        results[f"extract_details_{audio_format.name}"] = measure(extract, repeat)
+
+    return results
+
+
+def run(sizes=SIZES, backend="json", repeat=5, work_dir=None):
+    """
+    Run every benchmark against a generated catalog of each size.
+
+    Return: dict of results, suitable for JSON
+    """
+
+    results = {
+        "python": platform.python_version(),
+        "backend": backend,
+        "sizes": {},
+        "extract_details": benchmark_extract_details(repeat),
+    }
+
+    for size in sizes:
+
+        with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+            data_dir = Path(directory)
+            data = build_catalog(data_dir, size, backend)
+            results["sizes"][str(size)] = benchmark_catalog(data_dir, data, backend, repeat)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare the median timings of results against a baseline run.
+
+    Return: list of (benchmark name, baseline median, median, ratio), and the names of those slower than the baseline by more than tolerance
+    """
+
+    rows = []
+    regressions = []
+
+    def pairs(current, previous, prefix):
+
+        for name, timing in current.items():
+
+            if name in previous:
+                yield f"{prefix}{name}", previous[name]["median"], timing["median"]
+
+    groups = [pairs(results["extract_details"], baseline.get("extract_details", {}), "")]
+
+    for size, timings in results["sizes"].items():
+        groups.append(pairs(timings, baseline.get("sizes", {}).get(size, {}), f"{size}/"))
+
+    for group in groups:
+
+        for name, before, after in group:
+            ratio = after / before if before else float("inf")
+            rows.append((name, before, after, ratio))
+
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+
+    return rows, regressions
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date
 import mutagen
 from uuid import uuid4
 
@@ -37,9 +39,19 @@ class PodcastDatastore(ABC):
         """Save a new episode."""
         pass
 
+    def create_episodes(self, episodes):
+        """
+        Save several new episodes, each given as a dict of create_episode's keyword arguments.
+
+        episodes may be a generator; each input_file_handle must be read before the next episode is taken.  Backends should override this to store the catalog change in a single write; this fallback saves the episodes one by one.
+        """
+
+        for episode in episodes:
+            self.create_episode(**episode)
+
     @abstractmethod
-    def get_episodes(self):
-        """Produce an iterable of podcast.Episodes."""
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """Produce an iterable of podcast.Episodes, newest first, optionally paged as in visitor.PodcastDatastore."""
         pass
 
     @abstractmethod
@@ -52,6 +64,15 @@ class PodcastDatastore(ABC):
         """Delete an episode.""show " = """
         pass
 
+    @contextmanager
+    def transaction(self):
+        """
+        Provide an object with create_episode, create_episodes, update_episode and delete_episode, whose changes are all stored once the block completes, or none if it raises.
+
+        Backends should override this to store the changes in a single write; this fallback makes each change as it's called, and can't undo them.
+        """
+        yield self
+
 
 class AdminPodcast:
 
@@ -103,9 +124,9 @@ class AdminPodcast:
 
         return str(guid)
 
-    def get_episodes(self):
-        """Produce an iterable of episode data in dicts."""
-        return [dict(ep) for ep in self.datastore.get_episodes()]
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """Produce an iterable of episode data in dicts, newest first."""
+        return [dict(ep) for ep in self.datastore.get_episodes(offset=offset, limit=limit, since=since)]
 
     def update_episode(self, guid, title=None, description=None, duration=None, publication_date=None, audio_format=None):
         """Update an existing episode."""
@@ -116,50 +137,126 @@ class AdminPodcast:
         """Delete an episode."""
         self.datastore.delete_episode(guid)
 
-    def extract_details(self, filehandle):
+    @contextmanager
+    def transaction(self):
+        """
+        Make many episode changes at once, stored together when the block completes, or not at all if it raises.
+
+        Produce an AdminPodcast over the datastore's transaction, whose create_episode, create_episodes, ingest_episode, update_episode and delete_episode are queued.  A change to an unknown episode raises ValueError, at the latest when the block exits.
+        """
+
+        with self.datastore.transaction() as batch:
+            yield AdminPodcast(batch)
+
+    def ingest_episode(self, input_file_handle, title=None, description=None, publication_date=None):
+        """
+        Save a new episode from an open audio file, taking whatever isn't given from the file's own tags.
+
+        The file is only opened once: its tags are parsed and it's measured without reading it through, then it's rewound and copied into the datastore in a single sequential read.
+
+        Optional:
+            - title, description - default to the file's tags
+            - publication_date - datetime.date, default today
+
+        Return: the new episode guid
+        """
+
+        details = extract_details(input_file_handle)
+        input_file_handle.seek(0)
+
+        title = title or details["title"]
+
+        if title is None:
+            raise ValueError("Missing required title.")
+
+        description = description or details["description"]
+
+        if description is None:
+            raise ValueError("Missing required description.")
+
+        if publication_date is None:
+            publication_date = date.today()
+
+        return self.create_episode(input_file_handle, title, description, details["duration"], publication_date, details["audio_format"], details["length"])
+
+    def create_episodes(self, episodes):
         """
-        Attempt to extract the following from an audio file:
-        - duration
-        - audio format
-        - description
-        - length
+        Save several new episodes at once.
+
+        Required:
+            - episodes - iterable of dicts with create_episode's arguments: input_file_handle, title, description, duration, publication_date, audio_format, length
+
+        The episodes are consumed in order, and each input_file_handle is read before the next episode is taken, so they may be opened lazily by a generator.
+
+        Return: list of the new episode guids, in the same order
         """
 
-        audio_file = mutagen.File(filehandle)
+        guids = []
+
+        def batch():
+
+            for episode in episodes:
+                audio_format = AudioFormat(episode["audio_format"])  # minimal validation
+                guid = str(uuid4())
+                guids.append(guid)
+
+                yield dict(episode, guid=guid, audio_format=audio_format.value)
+
+        self.datastore.create_episodes(batch())
+
+        return guids
+
+    def extract_details(self, filehandle):
+        """Attempt to extract the details of an audio file, see extract_details()."""
+        return extract_details(filehandle)
+
+
+def extract_details(filehandle):
+    """
+    Attempt to extract the following from an audio file:
+    - duration
+    - audio format
+    - description
+    - length
+
+    A plain function, rather than a method, so that it can be run in worker processes.
+    """
+
+    audio_file = mutagen.File(filehandle)
 
-        format_name = audio_file.mime[0]
+    format_name = audio_file.mime[0]
 
-        if format_name == "audio/vorbis":
-            audio_format = AudioFormat.OggVorbis
+    if format_name == "audio/vorbis":
+        audio_format = AudioFormat.OggVorbis
 
-        elif format_name == "audio/ogg":
-            audio_format = AudioFormat.OggOpus
+    elif format_name == "audio/ogg":
+        audio_format = AudioFormat.OggOpus
 
-        else:
-            audio_format = AudioFormat.MP3
+    else:
+        audio_format = AudioFormat.MP3
 
-        duration = round(audio_file.info.length)
+    duration = round(audio_file.info.length)
 
-        filehandle.seek(0, 2)
-        length = filehandle.tell()
-        filehandle.seek(0)
+    filehandle.seek(0, 2)
+    length = filehandle.tell()
+    filehandle.seek(0)
 
-        if audio_format == AudioFormat.MP3:
-            title = audio_file.tags.get("TIT2")
-            description = audio_file.tags.get("TXXX:description")
-        else:
-            title = audio_file.tags.get("title")
-            description = audio_file.tags.get("description")
+    if audio_format == AudioFormat.MP3:
+        title = audio_file.tags.get("TIT2")
+        description = audio_file.tags.get("TXXX:description")
+    else:
+        title = audio_file.tags.get("title")
+        description = audio_file.tags.get("description")
 
-        if type(title) is list:
-            title = title[0]
+    if type(title) is list:
+        title = title[0]
 
-        if type(description) is list:
-            description = description[0]
+    if type(description) is list:
+        description = description[0]
 
-        return {"audio_format": audio_format.value,
-                "duration": duration,
-                "title": str(title),
-                "description": str(description),
-                "length": length,
-                }
+    return {"audio_format": audio_format.value,
+            "duration": duration,
+            "title": str(title),
+            "description": str(description),
+            "length": length,
+            }
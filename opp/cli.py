@@ -2,9 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 from datetime import date
+import json
+import os
+from pathlib import Path
+import sys
+from uuid import UUID
+import opp.administrator as administrator
 import opp.config as config
+import opp.profiling as profiling
+
+
+AUDIO_SUFFIXES = {".mp3", ".ogg", ".oga", ".opus"}
 
 
 def initialize_channel_parser(parser):
@@ -90,28 +101,98 @@ def create_episode(args):
     """Store an episode based on the arguments."""
     admin_podcast = args.admin_podcast
 
+    publication_date_string = getattr(args, "publication_date")
+
+    if publication_date_string is None:
+        publication_date = None
+    else:
+        publication_date = date.fromisoformat(publication_date_string)
+
     with open(args.file, "rb") as file:
-        details = admin_podcast.extract_details(file)
+        admin_podcast.ingest_episode(file, title=args.title, description=args.description, publication_date=publication_date)
 
-    title = getattr(args, "title") or details["title"]
 
-    if title is None:
-        raise ValueError("Missing required title.")
+def import_dir_parser(parser):
+    """Prepare a parser that can create episodes from every audio file in a directory."""
+    parser.set_defaults(func=import_dir)
+    parser.add_argument("directory", type=str, help="Directory of mp3, ogg vorbis, or opus files.")
+    parser.add_argument("--jobs", type=int, help="Number of files to read in parallel. Default: one per CPU.", default=os.cpu_count())
+    parser.add_argument("--publication-date", type=str, help="Date in YYYY-MM-DD format. Default: each file's modification date.")
 
-    description = getattr(args, "description") or details["description"]
+    return parser
 
-    if description is None:
-        raise ValueError("Missing required description.")
 
-    publication_date_string = getattr(args, "publication_date")
+def read_details(path):
+    """Extract the details of the audio file at path, in a worker process."""
 
-    if publication_date_string is None:
-        publication_date = date.today()
+    with open(path, "rb") as file:
+        return administrator.extract_details(file)
+
+
+def opened_episodes(details, publication_date, failures):
+    """
+    Produce the create_episodes arguments for each parsed file, opening the files one at a time.
+
+    Each file is closed once the datastore moves on to the next one, so a large import doesn't hold every file open at once.
+    """
+
+    for path, detail in details.items():
+
+        try:
+            file = open(path, "rb")
+        except OSError as error:
+            failures.append((path, error))
+            continue
+
+        with file:
+            yield {
+                "input_file_handle": file,
+                "title": detail["title"],
+                "description": detail["description"],
+                "duration": detail["duration"],
+                "publication_date": publication_date or date.fromtimestamp(os.fstat(file.fileno()).st_mtime),
+                "audio_format": detail["audio_format"],
+                "length": detail["length"],
+            }
+
+
+def import_dir(args):
+    """
+    Store an episode for each audio file in a directory.
+
+    Files are parsed in parallel, then copied, and the new episodes are added to the catalog in a single write.  Files that can't be read are reported and left out, without stopping the rest.
+    """
+    admin_podcast = args.admin_podcast
+
+    paths = sorted(path for path in Path(args.directory).iterdir() if path.suffix.lower() in AUDIO_SUFFIXES and path.is_file())
+
+    if args.publication_date is not None:
+        publication_date = date.fromisoformat(args.publication_date)
     else:
-        publication_date = date.fromisoformat(publication_date_string)
+        publication_date = None
 
-    with open(args.file, "rb") as file:
-        admin_podcast.create_episode(file, title, description, details["duration"], publication_date, details["audio_format"], details["length"])
+    details = {}
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {path: executor.submit(read_details, path) for path in paths}
+
+        for path, future in futures.items():
+
+            try:
+                details[path] = future.result()
+            except Exception as error:
+                failures.append((path, error))
+
+    guids = admin_podcast.create_episodes(opened_episodes(details, publication_date, failures))
+
+    for path, error in failures:
+        print(f"{path}: {error}", file=sys.stderr)
+
+    print(f"Imported {len(guids)} episodes, {len(failures)} failed.")
+
+    if failures:
+        sys.exit(1)
 
 
 def list_episode_parser(parser):
@@ -144,7 +225,12 @@ def update_episode(args):
     """Update an episode."""
     admin_podcast = args.admin_podcast
 
-    admin_podcast.update_episode(args.guid, title=args.title, description=args.description, publication_date=args.publication_date)
+    if args.publication_date is not None:
+        publication_date = date.fromisoformat(args.publication_date)
+    else:
+        publication_date = None
+
+    admin_podcast.update_episode(args.guid, title=args.title, description=args.description, publication_date=publication_date)
 
 
 def delete_episode_parser(parser):
@@ -161,6 +247,216 @@ def delete_episode(args):
     admin_podcast.delete_episode(args.guid)
 
 
+def bulk_edit_parser(parser):
+    """Prepare a parser that can apply a file of episode edits."""
+    parser.set_defaults(func=bulk_edit)
+    parser.add_argument("file", type=str, help="JSON lines file, one edit per line, e.g. {\"op\": \"update\", \"guid\": \"...\", \"publication_date\": \"2024-01-31\"}.")
+
+    return parser
+
+
+# The fields each kind of edit may have, besides "op"; the first ones listed are required.
+EDIT_FIELDS = {
+    "create": ["file", "title", "description", "publication_date"],
+    "update": ["guid", "title", "description", "duration", "publication_date"],
+    "delete": ["guid"],
+}
+
+
+def is_guid(value):
+    """Tell whether a value is a guid as the datastore writes them: a UUID in its canonical form."""
+
+    try:
+        return type(value) is str and str(UUID(value)) == value
+    except ValueError:
+        return False
+
+
+# What each field's value must be, and how to say so.  None is allowed for the optional ones, as "not given".
+FIELD_TYPES = {
+    "file": (lambda value: type(value) is str, "a string"),
+    "guid": (is_guid, "a UUID string"),
+    "title": (lambda value: type(value) is str, "a string"),
+    "description": (lambda value: type(value) is str, "a string"),
+    "duration": (lambda value: type(value) is int and value >= 0, "a whole number of seconds, 0 or more"),
+    "publication_date": (lambda value: type(value) is str, "a date in YYYY-MM-DD format"),
+}
+
+
+def read_edits(file):
+    """
+    Parse episode edits, one JSON object per line, checking them all before any is made.
+
+    Each edit has an "op" of "create", "update" or "delete", and the fields in EDIT_FIELDS.  A create takes the audio file's path, and reads whatever else isn't given from its tags, as create-episode does.
+
+    Each value is checked against FIELD_TYPES too, so a bad one is reported by its line rather than stored.
+
+    Return: list of (line number, edit) pairs, with publication dates parsed
+    """
+
+    edits = []
+
+    for number, line in enumerate(file, 1):
+
+        if not line.strip():
+            continue
+
+        try:
+            edit = json.loads(line)
+            op = edit.pop("op", None) if type(edit) is dict else None
+
+            if op not in EDIT_FIELDS:
+                raise ValueError(f"expected an object with \"op\" one of: {', '.join(EDIT_FIELDS)}")
+
+            required, *optional = EDIT_FIELDS[op]
+
+            if required not in edit:
+                raise ValueError(f"{op} needs \"{required}\"")
+
+            unknown = set(edit) - set(EDIT_FIELDS[op])
+
+            if unknown:
+                raise ValueError(f"{op} doesn't take {', '.join(sorted(unknown))}")
+
+            for name, value in edit.items():
+                check, expected = FIELD_TYPES[name]
+
+                if not check(value) and (value is not None or name == required):
+                    raise ValueError(f"\"{name}\" should be {expected}, not {json.dumps(value)}")
+
+            if edit.get("publication_date") is not None:
+                edit["publication_date"] = date.fromisoformat(edit["publication_date"])
+
+        except (ValueError, TypeError) as error:
+            raise ValueError(f"line {number}: {error}") from error
+
+        edits.append((number, dict(edit, op=op)))
+
+    return edits
+
+
+def apply_edit(admin_podcast, edit):
+    """Make an edit read by read_edits().  Return: the new episode's guid, for a create."""
+
+    fields = {name: value for name, value in edit.items() if name != "op"}
+
+    if edit["op"] == "create":
+
+        with open(fields.pop("file"), "rb") as file:
+            return admin_podcast.ingest_episode(file, **fields)
+
+    if edit["op"] == "update":
+        admin_podcast.update_episode(**fields)
+
+    else:
+        admin_podcast.delete_episode(fields["guid"])
+
+
+def bulk_edit(args):
+    """
+    Apply a file of episode edits, all together or not at all.
+
+    However many edits there are, the catalog is read and written once.
+    """
+    admin_podcast = args.admin_podcast
+    number = None
+
+    try:
+
+        with open(args.file, "r") as file:
+            edits = read_edits(file)
+
+        created = []
+
+        with admin_podcast.transaction() as batch:
+
+            for number, edit in edits:
+                guid = apply_edit(batch, edit)
+
+                if guid is not None:
+                    created.append((edit["file"], guid))
+
+            # Anything failing from here on comes from storing the edits, and names the episode rather than a line.
+            number = None
+
+    except (OSError, ValueError) as error:
+        where = f"line {number}: " if number is not None else ""
+        print(f"{args.file}: {where}{error}", file=sys.stderr)
+        print("No changes made.", file=sys.stderr)
+        sys.exit(1)
+
+    for path, guid in created:
+        print(f"{path}: {guid}")
+
+    print(f"Applied {len(edits)} edits.")
+
+
+def export_static_parser(parser):
+    """Prepare a parser that can export the podcast as a static site."""
+    parser.set_defaults(func=export_static)
+    parser.add_argument("directory", type=str, help="Directory to write the site into.")
+    parser.add_argument("--base-url", type=str, help="URL the directory will be served from. Default: the channel link.")
+
+    return parser
+
+
+def export_static(args):
+    """Export the podcast as a static site, rewriting only what changed."""
+    import opp.web.export as export
+
+    for name in export.export_static(Path(args.directory), base_url=args.base_url):
+        print(name)
+
+
+def serve_parser(parser):
+    """Prepare a parser that can serve the podcast over HTTP."""
+    # Profiling a server's whole lifetime tells nothing; OPP_PROFILE applies to its requests instead.
+    parser.set_defaults(func=serve, profile=False)
+    parser.add_argument("--host", type=str, help="Address to listen on. Default 127.0.0.1", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port to listen on. Default 8000", default=8000)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio server, which sends episode audio without tying up a thread per download.")
+
+    return parser
+
+
+def serve(args):
+    """Serve the podcast, with the asyncio server or Flask's own; or every podcast in OPP_TENANTS, with Werkzeug's."""
+
+    if config.tenants_dir() is not None:
+        from werkzeug.serving import run_simple
+        import opp.web.tenants as tenants
+
+        if args.use_async:
+            sys.exit("--async serves a single podcast; unset OPP_TENANTS to use it.")
+
+        run_simple(args.host, args.port, tenants.create_tenants(), threaded=True)
+
+    elif args.use_async:
+        import opp.web.aio as aio
+
+        aio.serve(args.host, args.port)
+
+    else:
+        import opp.web.app as web
+
+        web.create_app().run(host=args.host, port=args.port, threaded=True)
+
+
+def migrate_sqlite_parser(parser):
+    """Prepare a parser that can copy the JSON datastore into SQLite."""
+    parser.set_defaults(func=migrate_sqlite)
+
+    return parser
+
+
+def migrate_sqlite(args):
+    """Copy the JSON datastore into an SQLite datastore in the same directory."""
+    import opp.datastore.sqlite as sqlite
+
+    count = sqlite.migrate_json(config.datastore_dir())
+    print(f"Copied {count} episodes.  Set OPP_BACKEND=sqlite to use the new datastore.")
+
+
 def main():
     config.init_admin()
 
@@ -174,12 +470,23 @@ def main():
     update_channel_parser(subparsers.add_parser("update-channel"))
 
     create_episode_parser(subparsers.add_parser("create-episode"))
+    import_dir_parser(subparsers.add_parser("import-dir"))
     list_episode_parser(subparsers.add_parser("list-episodes"))
     update_episode_parser(subparsers.add_parser("update-episode"))
     delete_episode_parser(subparsers.add_parser("delete-episode"))
+    bulk_edit_parser(subparsers.add_parser("bulk-edit"))
+
+    export_static_parser(subparsers.add_parser("export-static"))
+    serve_parser(subparsers.add_parser("serve"))
+    migrate_sqlite_parser(subparsers.add_parser("migrate-sqlite"))
+
+    parser.set_defaults(profile=True)
 
     args = parser.parse_args()
-    args.func(args)
+    threshold = config.profile_threshold() if args.profile else None
+
+    with profiling.profiled(f"cli-{args.func.__name__}", threshold, config.profile_dir(), lambda: {"command": sys.argv[1:], "episodes": len(args.admin_podcast.get_episodes())}):
+        args.func(args)
 
 
 if __name__ == "__main__":
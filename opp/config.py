@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import importlib
 from os import environ
 from pathlib import Path
 
-import opp.administrator as administrator
-import opp.datastore.json_file as jsf
+import opp.profiling as profiling
 import opp.visitor as visitor
 
 
+# Imported when selected, so a web worker doesn't load every backend, nor the administrator's audio parsing.
+BACKENDS = {
+    "json": "opp.datastore.json_file",
+    "journal": "opp.datastore.journal",
+    "sqlite": "opp.datastore.sqlite",
+}
+
+
 def datastore_dir():
 
     if "OPP" in environ:
@@ -17,20 +25,184 @@ def datastore_dir():
     return Path(environ["HOME"]) / ".config/opp/"
 
 
-def init_visitor():
-    global VISIT_PODCAST
-    visitor_ds = jsf.VisitorDS(datastore_dir())
-    VISIT_PODCAST = visitor.VisitPodcast(visitor_ds)
+def backend(name=None):
+    "Produce the named datastore module, by default the one selected by OPP_BACKEND: json, journal or sqlite.  Default 'json'."
+
+    if name is None:
+        name = environ.get("OPP_BACKEND", "json")
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OPP_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}")
+
+    return importlib.import_module(BACKENDS[name])
+
+
+def reload_interval():
+    "Produce the number of seconds between checks for catalog changes."
+    return float(environ.get("OPP_RELOAD_INTERVAL", 1.0))
+
+
+def page_size():
+    "Produce the number of episodes on each page of the home page.  Default 20."
+    size = int(environ.get("OPP_PAGE_SIZE", 20))
+
+    if size < 1:
+        raise ValueError(f"OPP_PAGE_SIZE must be at least 1, not {size}")
+
+    return size
+
+
+def feed_limit():
+    "Produce the number of latest episodes in the RSS feed, or None for the whole back catalog (the default)."
+
+    if "OPP_FEED_LIMIT" in environ:
+        return int(environ["OPP_FEED_LIMIT"])
+
+    return
+
+
+SENDFILE_HEADERS = {
+    "x-accel-redirect": "X-Accel-Redirect",
+    "x-sendfile": "X-Sendfile",
+}
+
+
+def sendfile_header():
+    "Produce the header that hands episode downloads to the front-end server, per OPP_SENDFILE: x-accel-redirect (nginx) or x-sendfile (Apache, lighttpd).  Default None, to serve them from Python."
+    name = environ.get("OPP_SENDFILE")
+
+    if not name:
+        return
+
+    if name.lower() not in SENDFILE_HEADERS:
+        raise ValueError(f"Unknown OPP_SENDFILE '{name}', expected one of: {', '.join(SENDFILE_HEADERS)}")
+
+    return SENDFILE_HEADERS[name.lower()]
+
+
+def sendfile_prefix():
+    "Produce the internal location that X-Accel-Redirect points into, from OPP_SENDFILE_PREFIX.  Default '/opp-episodes/'"
+    return environ.get("OPP_SENDFILE_PREFIX", "/opp-episodes/")
+
+
+def metrics_address():
+    "Produce the (host, port) to serve metrics on, apart from the app, from OPP_METRICS_PORT and OPP_METRICS_HOST (default 127.0.0.1).  Default None, for /metrics on the app itself."
+
+    if not environ.get("OPP_METRICS_PORT"):
+        return
+
+    return environ.get("OPP_METRICS_HOST", "127.0.0.1"), int(environ["OPP_METRICS_PORT"])
+
+
+def app_metrics():
+    "Tell whether the app serves /metrics itself: unless they're served on their own port."
+    return metrics_address() is None
+
+
+def profile_threshold():
+    "Produce the duration, in seconds, past which requests and commands are profiled, from OPP_PROFILE (e.g. 'slow:200ms').  Default None, no profiling."
+    return profiling.parse_setting(environ.get("OPP_PROFILE"))
+
+
+def profile_dir(directory=None):
+    "Produce the directory profiles are dumped into, from OPP_PROFILE_DIR.  Default: profiles/ in the datastore directory, or in directory if given."
+
+    if "OPP_PROFILE_DIR" in environ:
+        return Path(environ["OPP_PROFILE_DIR"])
+
+    return (directory or datastore_dir()) / "profiles"
+
+
+def sighup_reload():
+    "Tell whether SIGHUP should make the catalog be re-read, per OPP_SIGHUP."
+    return "OPP_SIGHUP" in environ
+
+
+def visit_podcast(directory=None):
+    "Produce the visitor use case over the configured datastore, or the one in directory if given."
+    visitor_ds = backend().VisitorDS(directory or datastore_dir(), check_interval=reload_interval())
+    return visitor.VisitPodcast(visitor_ds)
+
+
+def tenants_dir():
+    "Produce the directory holding a datastore directory for each podcast, to serve them all from one process, from OPP_TENANTS.  Default None, to serve the single podcast in datastore_dir()."
+
+    if not environ.get("OPP_TENANTS"):
+        return
+
+    return Path(environ["OPP_TENANTS"])
+
+
+TENANT_ROUTING = ["path", "host"]
+
+
+def tenant_routing():
+    "Produce how requests find their podcast, per OPP_TENANT_ROUTING: 'path', by the first segment of the URL path, or 'host', by the Host header.  Default 'path'."
+    routing = environ.get("OPP_TENANT_ROUTING", "path").lower()
+
+    if routing not in TENANT_ROUTING:
+        raise ValueError(f"Unknown OPP_TENANT_ROUTING '{routing}', expected one of: {', '.join(TENANT_ROUTING)}")
+
+    return routing
+
+
+def tenant_cache_size():
+    "Produce the number of podcasts kept loaded at once, from OPP_TENANT_CACHE.  Default 16."
+    return int(environ.get("OPP_TENANT_CACHE", 16))
+
+
+def tenant_idle():
+    "Produce the number of seconds a podcast stays loaded without requests, from OPP_TENANT_IDLE.  Default 600."
+    return float(environ.get("OPP_TENANT_IDLE", 600))
+
+
+class TenantConfig:
+
+    """
+    The settings of one of several podcasts served from one process: those of this module, but with the podcast's own datastore directory.
+
+    Settings that depend on the directory are the module's functions, given the podcast's.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __getattr__(self, name):
+
+        if name not in globals():
+            raise AttributeError(name)
+
+        return globals()[name]
+
+    def datastore_dir(self):
+        return self.directory
+
+    def visit_podcast(self):
+        return visit_podcast(self.directory)
+
+    def css_file(self):
+        return css_file(self.directory)
+
+    def profile_dir(self):
+        return profile_dir(self.directory)
+
+    def app_metrics(self):
+        # The metrics are the whole process's, with no podcast label; they're only served on OPP_METRICS_PORT.
+        return False
+
+    def sighup_reload(self):
+        # One handler per process: opp.web.tenants reloads every loaded podcast.
+        return False
 
 
 def init_admin():
     global ADMIN_PODCAST
+    import opp.administrator as administrator
 
-    admin_ds = jsf.AdminDS(datastore_dir())
+    admin_ds = backend().AdminDS(datastore_dir())
     ADMIN_PODCAST = administrator.AdminPodcast(admin_ds)
 
 
-def css_file():
-    "Produce path for a custom css file."
-    directory = datastore_dir()
-    return directory / "web/style.css"
+def css_file(directory=None):
+    "Produce path for a custom css file, in the datastore directory, or in directory if given."
+    return (directory or datastore_dir()) / "web/style.css"
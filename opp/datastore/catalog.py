@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import bisect
+from datetime import date
+import itertools
+from operator import attrgetter, itemgetter
+from pathlib import Path
+import uuid
+
+import opp.podcast as podcast
+
+"""
+Immutable, in-memory catalog snapshots shared by the file based datastores.
+
+A snapshot is built once and then only ever read.  Datastores publish a new snapshot by rebinding a single attribute, so a request that already holds the previous snapshot keeps a consistent view without any locking.
+"""
+
+
+_generations = itertools.count(1)
+AUDIO_FORMATS = tuple(podcast.AudioFormat)
+
+
+def select(episodes, offset=0, limit=None, since=None, published=attrgetter("publication_date")):
+    """
+    Produce a page of episodes from a sequence ordered newest first.
+
+    Optional:
+        - offset - number of episodes to skip
+        - limit - maximum number of episodes, or None for all of them
+        - since - datetime.date, leave out episodes published before it
+        - published - produce the publication date of an episode
+
+    The end of the since range is found by bisection, so the cost depends on the size of the page, not of the catalog.
+    """
+
+    end = len(episodes)
+
+    if since is not None:
+        end = bisect.bisect_right(episodes, -since.toordinal(), key=lambda ep: -published(ep).toordinal())
+
+    start = min(offset, end)
+
+    if limit is not None:
+        end = min(end, start + limit)
+
+    return episodes[start:end]
+
+
+def order_key(ep_data):
+    """Sort key that puts stored episode data newest first, for use with bisect."""
+    return -date.fromisoformat(ep_data["publication_date"]).toordinal()
+
+
+def position(episodes, ep_data):
+    """Produce the position of ep_data in the ordered episodes, found by bisection on its date."""
+
+    idx = bisect.bisect_left(episodes, order_key(ep_data), key=order_key)
+
+    while episodes[idx] is not ep_data:
+        idx += 1
+
+    return idx
+
+
+class EpisodeIndex:
+
+    """
+    Keep a list of stored episode data newest first, with a map from guid to episode data, as it's modified.
+
+    Among equal dates, episodes stay in the order they were added.  Each change bisects for the episode's position, so it costs O(log n) comparisons rather than a sort.  Episode dicts are never changed in place; updated episodes are replaced by new dicts, so they can be used to tell which episodes changed.
+    """
+
+    def __init__(self, episodes):
+        # Catalogs written before updates kept the order need one sort; an ordered list costs a single pass.
+        episodes.sort(key=order_key)
+
+        self.episodes = episodes  # Modified in place
+        self.by_guid = {ep["guid"]: ep for ep in episodes}
+
+    def __contains__(self, guid):
+        return guid in self.by_guid
+
+    def __getitem__(self, guid):
+        return self.by_guid[guid]
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def find(self, guid):
+        """Produce the data of an episode, raising ValueError if there's no such episode."""
+
+        if guid not in self.by_guid:
+            raise ValueError(f"{guid} is not an episode")
+
+        return self.by_guid[guid]
+
+    def insert(self, ep_data):
+        """Add a new episode, after any others published the same day."""
+        bisect.insort_right(self.episodes, ep_data, key=order_key)
+        self.by_guid[ep_data["guid"]] = ep_data
+
+    def update(self, guid, changes):
+        """
+        Replace an episode's data with a copy having changes applied, moving it if its date changed.
+
+        Return: the new episode data
+        """
+
+        old = self.find(guid)
+        new = dict(old, **changes)
+        idx = position(self.episodes, old)
+
+        if new["publication_date"] == old["publication_date"]:
+            self.episodes[idx] = new
+        else:
+            self.episodes.pop(idx)
+            bisect.insort_right(self.episodes, new, key=order_key)
+
+        self.by_guid[guid] = new
+        return new
+
+    def delete(self, guid):
+        """
+        Remove an episode.
+
+        Return: the removed episode data
+        """
+
+        old = self.find(guid)
+        self.episodes.pop(position(self.episodes, old))
+        del self.by_guid[guid]
+        return old
+
+    def apply(self, change):
+        """
+        Make a change given as a record: {"op": "create", "episode": ep_data}, {"op": "update", "guid": guid, "changes": changes} or {"op": "delete", "guid": guid}.
+
+        Return: the episode data created, updated or removed
+        """
+
+        op = change["op"]
+
+        if op == "create":
+            self.insert(change["episode"])
+            return change["episode"]
+
+        if op == "update":
+            return self.update(change["guid"], change["changes"])
+
+        if op == "delete":
+            return self.delete(change["guid"])
+
+        raise ValueError(f"Unknown episode operation '{op}'")
+
+
+class Catalog:
+
+    """A read-only view of the channel and its episodes, newest first, as of one version of the backing store."""
+
+    def __init__(self, channel, episodes, stamp=None, modified=None):
+        self.channel = channel
+        # Stable, so episodes published the same day keep their stored order.  Already sorted input costs a single pass.
+        self.episodes = tuple(sorted(episodes, key=attrgetter("publication_date"), reverse=True))
+        self.by_guid = {str(ep.guid): ep for ep in self.episodes}
+
+        self.stamp = stamp  # Backend specific token used to detect changes
+        self.modified = modified  # datetime of the last change, if known
+        self.version = next(_generations)
+
+    def get_episode(self, guid):
+        """Produce the episode with the given guid (as a string), or None."""
+        return self.by_guid.get(guid)
+
+    def select(self, offset=0, limit=None, since=None):
+        """Produce a page of the episodes, see select()."""
+        return select(self.episodes, offset, limit, since)
+
+    def __repr__(self):
+        return f"Catalog(version={self.version}, episodes={len(self.episodes)})"
+
+
+class ColumnarCatalog:
+
+    """
+    A Catalog for large podcasts, built from the stored episode data rather than from Episodes.
+
+    Each field is kept as a column: durations, lengths, dates and audio formats in packed arrays, guids as 16 byte keys in a single bytes object.  Episodes are only built for the pages and the single episodes asked for, so a worker holds a few dozen bytes per episode besides its text.
+    """
+
+    def __init__(self, channel, episodes_data, stamp=None, modified=None):
+        self.channel = channel
+        # ISO dates sort as the dates do; stable, as in Catalog.
+        episodes_data = sorted(episodes_data, key=itemgetter("publication_date"), reverse=True)
+
+        self._titles = tuple(ep["title"] for ep in episodes_data)
+        self._descriptions = tuple(ep["description"] for ep in episodes_data)
+        self._paths = tuple(ep["path"] for ep in episodes_data)
+        self._guids = b"".join(uuid.UUID(ep["guid"]).bytes for ep in episodes_data)
+        self._durations = array("q", (ep["duration"] for ep in episodes_data))
+        self._lengths = array("q", (ep["length"] for ep in episodes_data))
+        self._dates = array("l", (date.fromisoformat(ep["publication_date"]).toordinal() for ep in episodes_data))
+        self._formats = array("B", (AUDIO_FORMATS.index(podcast.AudioFormat(ep["audio_format"])) for ep in episodes_data))
+
+        # Positions ordered by guid, searched by bisection: 4 bytes an episode rather than a dict entry.
+        self._guid_order = array("I", sorted(range(len(self)), key=self._guid_key))
+
+        self.stamp = stamp
+        self.modified = modified
+        self.version = next(_generations)
+
+    def _guid_key(self, position):
+        return self._guids[position * 16:position * 16 + 16]
+
+    def _episode(self, position):
+        """Build the Episode at position."""
+        return podcast.Episode(self._titles[position], self._descriptions[position], uuid.UUID(bytes=self._guid_key(position)), self._durations[position], date.fromordinal(self._dates[position]), AUDIO_FORMATS[self._formats[position]], Path(self._paths[position]), self._lengths[position])
+
+    def get_episode(self, guid):
+        """Produce the episode with the given guid (as a string), or None."""
+
+        try:
+            parsed = uuid.UUID(guid)
+        except ValueError:
+            return
+
+        # As in Catalog, only the canonical form names an episode.
+        if str(parsed) != guid:
+            return
+
+        key = parsed.bytes
+        found = bisect.bisect_left(self._guid_order, key, key=self._guid_key)
+
+        if found < len(self) and self._guid_key(self._guid_order[found]) == key:
+            return self._episode(self._guid_order[found])
+
+    def select(self, offset=0, limit=None, since=None):
+        """Produce a page of the episodes, see select()."""
+        positions = select(range(len(self)), offset, limit, since, published=lambda position: date.fromordinal(self._dates[position]))
+        return tuple(self._episode(position) for position in positions)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __repr__(self):
+        return f"ColumnarCatalog(version={self.version}, episodes={len(self)})"
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from datetime import date
+import uuid
+
+import opp.podcast as podcast
+import opp.datastore.files as files
+
+from pathlib import Path
+
+"""
+Episode data handling shared by the datastore backends.
+
+The backends all store an episode as the same dict of JSON-compatible data, and copy its audio the same way.  Batched changes are queued as records in the journal backend's format, see Transaction.
+"""
+
+
+def data_to_channel(channel_data):
+    """Convert the JSON data to a Channel object."""
+
+    channel = podcast.Channel(channel_data["title"], channel_data["link"], channel_data["description"], channel_data["image"], channel_data["author"], channel_data["email"], channel_data["language"], channel_data["category"], channel_data["explicit"], channel_data["keywords"])
+    return channel
+
+
+def data_to_episode(ep_data):
+    """Convert the JSON data to an Episode object."""
+
+    episode = podcast.Episode(ep_data["title"], ep_data["description"], uuid.UUID(ep_data["guid"]), ep_data["duration"], date.fromisoformat(ep_data["publication_date"]), podcast.AudioFormat(ep_data["audio_format"]), Path(ep_data["path"]), ep_data["length"])
+    return episode
+
+
+def store_episode(episode_dir, input_file_handle, title, description, guid, duration, publication_date, audio_format):
+    """
+    Copy an episode's audio into episode_dir.
+
+    Return: the episode data to be stored in the catalog
+    """
+
+    audio_file_path = files.audio_file_path(episode_dir, guid, audio_format)
+
+    # Record the length of what was actually stored, since that is what will be served.
+    sha256, length = files.store_stream(input_file_handle, audio_file_path)
+
+    return {
+        "title": title,
+        "description": description,
+        "guid": guid,
+        "duration": duration,
+        "publication_date": publication_date.isoformat(),
+        "audio_format": audio_format,
+        "path": str(audio_file_path),
+        "length": length,
+        "sha256": sha256
+    }
+
+
+def store_episodes(episode_dir, episodes):
+    """
+    Copy the audio of several episodes, each given as a dict of create_episode's arguments, into episode_dir.
+
+    If any copy fails, the audio already copied is removed again before the error is raised.
+
+    Return: list of the episode data to be stored in the catalog
+    """
+
+    stored = []
+
+    try:
+
+        for episode in episodes:
+            stored.append(store_episode(episode_dir, episode["input_file_handle"], episode["title"], episode["description"], episode["guid"], episode["duration"], episode["publication_date"], episode["audio_format"]))
+
+    except BaseException:
+
+        for ep_data in stored:
+            Path(ep_data["path"]).unlink(missing_ok=True)
+
+        raise
+
+    return stored
+
+
+def episode_changes(title=None, description=None, duration=None, publication_date=None):
+    """Produce the changes to an episode's stored data for update_episode's arguments, leaving out those not given."""
+
+    changes = {attribute: value for attribute, value in [("title", title), ("description", description), ("duration", duration)] if value is not None}
+
+    if publication_date is not None:
+        changes["publication_date"] = publication_date.isoformat()
+
+    return changes
+
+
+class Transaction:
+
+    """
+    Queue episode changes made within a datastore's transaction(), to be stored together.
+
+    Changes are kept as records, as the journal backend stores them: {"op": "create", "episode": ep_data}, {"op": "update", "guid": guid, "changes": changes} or {"op": "delete", "guid": guid}.  New episodes' audio is copied straight away, and removed again by discard() if the changes are never stored.
+    """
+
+    def __init__(self, episode_dir):
+        self._episode_dir = episode_dir
+        self.records = []
+
+    def create_episode(self, input_file_handle, title, description, guid, duration, publication_date, audio_format, length):
+        """Queue a new episode."""
+        ep_data = store_episode(self._episode_dir, input_file_handle, title, description, guid, duration, publication_date, audio_format)
+        self.records.append({"op": "create", "episode": ep_data})
+
+    def create_episodes(self, episodes):
+        """Queue several new episodes, see PodcastDatastore.create_episodes()."""
+        self.records.extend({"op": "create", "episode": ep_data} for ep_data in store_episodes(self._episode_dir, episodes))
+
+    def update_episode(self, guid, **kwargs):
+        """Queue an update of an existing episode."""
+        self.records.append({"op": "update", "guid": guid, "changes": episode_changes(**kwargs)})
+
+    def delete_episode(self, guid):
+        """Queue the deletion of an episode."""
+        self.records.append({"op": "delete", "guid": guid})
+
+    def discard(self):
+        """Remove the audio copied for new episodes."""
+
+        for record in self.records:
+
+            if record["op"] == "create":
+                Path(record["episode"]["path"]).unlink(missing_ok=True)
+
+
+@contextmanager
+def transaction(episode_dir, commit):
+    """
+    Provide a Transaction, then store its changes by calling commit with its records.
+
+    commit must store all the records or none, raising ValueError for a change to an unknown episode, and produce the stored data of the episodes deleted.  Their audio is removed once they are stored; if anything fails, the audio of new episodes is removed instead.
+    """
+
+    batch = Transaction(episode_dir)
+
+    try:
+        yield batch
+        deleted = commit(batch.records) if batch.records else []
+
+    except BaseException:
+        batch.discard()
+        raise
+
+    # Only remove the audio once the catalog no longer refers to it.
+    for ep_data in deleted:
+        Path(ep_data["path"]).unlink(missing_ok=True)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import secrets
+import stat
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+import opp.podcast as podcast
+
+"""
+File handling shared by the datastore backends.
+"""
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def audio_file_path(episode_dir, guid, audio_format):
+    """Produce the path name for an episode."""
+
+    af = podcast.AudioFormat(audio_format)
+
+    if af == podcast.AudioFormat.OggOpus:
+        ext = "opus"  # Looks wrong, but not.
+
+    elif af == podcast.AudioFormat.OggVorbis:
+        ext = "ogg"
+
+    else:
+        ext = "mp3"
+
+    return episode_dir / f"{guid}.{ext}"
+
+
+def temporary_file(path, mode="wb"):
+    """
+    Create and open a uniquely named temporary file beside path, to be renamed over it later.
+
+    The file is created with the same permissions a plain open() would give it (0666 less the umask), rather than tempfile's private 0600, so it stays readable by the web server once renamed into place.
+
+    Return: (temporary path name, open file)
+    """
+
+    while True:
+        name = str(path.parent / f".{path.name}.{secrets.token_hex(8)}")
+
+        try:
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            continue
+
+        return name, os.fdopen(fd, mode)
+
+
+def store_stream(input_file_handle, path, chunk_size=CHUNK_SIZE):
+    """
+    Copy everything remaining in input_file_handle to path.
+
+    The data is read once, in fixed-size chunks, so memory use does not depend on the size of the file.  The hash and the length are computed as the data passes through.  It is written to a temporary file in the same directory, which is renamed over path only once complete, so path never holds a partial file.
+
+    Return: (sha256 hex digest, length in bytes)
+    """
+
+    digest = hashlib.sha256()
+    length = 0
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    readinto = getattr(input_file_handle, "readinto", None)
+
+    temporary, file = temporary_file(path)
+
+    try:
+        with file:
+
+            while True:
+
+                if readinto is not None:
+                    count = readinto(buffer)
+                    chunk = view[:count]
+                else:
+                    chunk = input_file_handle.read(chunk_size)
+                    count = len(chunk)
+
+                if not count:
+                    break
+
+                digest.update(chunk)
+                file.write(chunk)
+                length += count
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary, path)
+
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    return digest.hexdigest(), length
+
+
+def write_json(path, data):
+    """
+    Replace the file at path with data, serialized as JSON.
+
+    The new content is written and fsync'ed to a temporary file, then renamed over path.  Anyone opening path sees either the complete old file or the complete new one.
+    """
+    write_atomic(path, lambda file: json.dump(data, file))
+
+
+def write_text(path, text):
+    """Replace the file at path with text, as write_json does."""
+    write_atomic(path, lambda file: file.write(text))
+
+
+def write_atomic(path, write):
+    """Replace the file at path with whatever write(file) writes to the text file it's given."""
+
+    temporary, file = temporary_file(path, "w")
+
+    try:
+        with file:
+            write(file)
+            file.flush()
+
+            # Keep the permissions of the file being replaced, e.g. if it was made readable by the web server's group.
+            try:
+                os.chmod(file.fileno(), stat.S_IMODE(os.stat(path).st_mode))
+            except FileNotFoundError:
+                pass
+
+            os.fsync(file.fileno())
+
+        os.replace(temporary, path)
+
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    fsync_dir(path.parent)
+
+
+def fsync_dir(directory):
+    """Make a rename within the directory durable."""
+
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive advisory lock on the file at path, creating it if need be.
+
+    Only writers take the lock; readers rely on write_json's atomic replacement instead.
+    """
+
+    with open(path, "a") as file:
+
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
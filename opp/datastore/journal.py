@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime, timezone
+import json
+import os
+import threading
+import time
+
+import opp.visitor as visitor
+import opp.administrator as adm
+from opp.datastore.catalog import Catalog, EpisodeIndex, select
+import opp.datastore.files as files
+from opp.datastore.common import data_to_channel, data_to_episode, episode_changes, store_episode, store_episodes, transaction
+
+from pathlib import Path
+
+
+"""
+Append-only journal datastore backend.
+
+The catalog is kept as a JSON snapshot plus a JSON-lines journal of the changes made since.  Each change is a single append to the journal.  Once the journal grows long enough, it is compacted: folded into a new snapshot, alongside a new, empty journal, in a background thread.
+
+Snapshot and journal are numbered as a pair, and a small pointer file names the current pair.  Readers follow the pointer and tail the journal, applying only the records they haven't seen yet.  Compaction never changes a file a reader may be using; it writes a new pair, moves the pointer, then removes the old pair.
+"""
+
+
+JOURNAL_DIR = "journal/"
+EPISODE_DIR = "episodes/"
+CURRENT = "CURRENT"
+LOCK_FILE = "journal.lock"
+
+COMPACT_THRESHOLD = 1024 * 1024  # Journal size, in bytes, that triggers compaction
+
+
+def snapshot_name(segment):
+    return f"snapshot-{segment:08d}.json"
+
+
+def journal_name(segment):
+    return f"journal-{segment:08d}.jsonl"
+
+
+def apply(podcast_data, index, record):
+    """Apply a journal record to podcast data, and to its EpisodeIndex."""
+
+    if record["op"] == "channel":
+        podcast_data["channel"] = record["channel"]
+    else:
+        index.apply(record)
+
+
+def read_segment(journal_dir):
+    """Produce the number of the current snapshot and journal pair."""
+
+    with open(journal_dir / CURRENT, "r") as file:
+        return int(file.read())
+
+
+def truncate_partial_record(fd):
+    """
+    Cut a journal back to its last complete record.
+
+    A writer that dies mid-append leaves a partial line at the end.  Readers skip it, but anything appended after it would be glued onto it, so it has to go before the next append.
+    """
+
+    size = os.fstat(fd).st_size
+    end = size
+
+    while end > 0:
+        start = max(0, end - 4096)
+        chunk = os.pread(fd, end - start, start)
+        newline = chunk.rfind(b"\n")
+
+        if newline != -1:
+            end = start + newline + 1
+            break
+
+        end = start
+
+    if end != size:
+        os.ftruncate(fd, end)
+
+
+class JournalReader:
+
+    """Follow the current snapshot and journal, keeping the podcast data up to date."""
+
+    def __init__(self, journal_dir):
+        self._journal_dir = journal_dir
+
+        self.segment = None
+        self.offset = 0
+        self.records = 0  # Records applied on top of the snapshot
+        self.podcast_data = None
+        self.index = None  # EpisodeIndex of podcast_data's episodes
+        self.modified = None
+
+    def refresh(self):
+        """
+        Catch up with any changes.
+
+        Return: True if the podcast data changed
+        """
+
+        while True:
+
+            segment = read_segment(self._journal_dir)
+
+            try:
+                return self._refresh(segment)
+
+            except FileNotFoundError:
+                # Compacted between reading the pointer and opening its files; follow the new pointer.
+                self.segment = None
+
+    def _refresh(self, segment):
+        changed = False
+
+        if segment != self.segment:
+
+            with open(self._journal_dir / snapshot_name(segment), "r") as file:
+                podcast_data = json.load(file)
+
+            podcast_data.setdefault("episodes", [])
+
+            self.podcast_data = podcast_data
+            self.index = EpisodeIndex(podcast_data["episodes"])
+            self.segment = segment
+            self.offset = 0
+            self.records = 0
+            changed = True
+
+        with open(self._journal_dir / journal_name(segment), "rb") as file:
+            stat = os.fstat(file.fileno())
+
+            if stat.st_size > self.offset:
+                file.seek(self.offset)
+                tail = file.read()
+            else:
+                tail = b""
+
+        if changed or self.modified is None:
+            self.modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+        # Only whole lines; a partial line is a write in progress.
+        complete = tail[:tail.rfind(b"\n") + 1]
+
+        for line in complete.splitlines():
+
+            if line.strip():
+                apply(self.podcast_data, self.index, json.loads(line))
+                self.records += 1
+                changed = True
+
+        if complete:
+            self.offset += len(complete)
+            self.modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+        return changed
+
+
+class VisitorDS(visitor.PodcastDatastore):
+
+    """
+    Provide a visitor Datastore using a journal backend.
+
+    Like the JSON backend, the catalog is held as an immutable snapshot and replaced when it changes.  Changes are found by tailing the journal, at most once every check_interval seconds, so only new records are parsed.
+    """
+
+    def __init__(self, data_dir, check_interval=1.0):
+        self._reader = JournalReader(data_dir / JOURNAL_DIR)
+        self._episode_dir = data_dir / EPISODE_DIR
+        self._episode_memo = {}
+
+        self._check_interval = check_interval
+        self._next_check = time.monotonic() + check_interval
+        self._lock = threading.Lock()
+
+        self._reader.refresh()
+        self._catalog = self._build()
+
+    def _build(self):
+        """Produce a catalog snapshot from the reader's podcast data, reusing Episodes that haven't changed."""
+
+        podcast_data = self._reader.podcast_data
+        memo = {}
+        episodes = []
+
+        for ep_data in podcast_data["episodes"]:
+            known = self._episode_memo.get(ep_data["guid"])
+
+            if known is not None and known[0] is ep_data:
+                episode = known[1]
+            else:
+                episode = data_to_episode(ep_data)
+
+            memo[ep_data["guid"]] = (ep_data, episode)
+            episodes.append(episode)
+
+        self._episode_memo = memo
+
+        return Catalog(data_to_channel(podcast_data["channel"]), episodes, stamp=(self._reader.segment, self._reader.offset), modified=self._reader.modified)
+
+    def _current(self):
+        """Produce the current catalog snapshot, catching up with the journal first if it's time to check."""
+
+        catalog = self._catalog
+        now = time.monotonic()
+
+        if now < self._next_check:
+            return catalog
+
+        # The reader is shared state; one thread catches up while the rest keep serving the current snapshot.
+        if not self._lock.acquire(blocking=False):
+            return catalog
+
+        try:
+            self._next_check = now + self._check_interval
+
+            if self._reader.refresh():
+                catalog = self._build()
+                self._catalog = catalog
+
+        except (OSError, ValueError, KeyError):
+            # Unreadable for now; keep serving the last good snapshot, and start over on the next check.
+            self._reader.segment = None
+
+        finally:
+            self._lock.release()
+
+        return catalog
+
+    def reload(self):
+        """Check the journal on the next access."""
+        self._next_check = 0
+
+    def get_channel(self):
+        return self._current().channel
+
+    def get_episodes(self, offset=0, limit=None, since=None):
+        return self._current().select(offset, limit, since)
+
+    def get_episode(self, guid):
+        return self._current().get_episode(guid)
+
+    def catalog_version(self):
+        return self._current().version
+
+    def catalog_modified(self):
+        return self._current().modified
+
+    @property
+    def episode_dir(self):
+        return self._episode_dir
+
+
+class AdminDS(adm.PodcastDatastore):
+
+    """Provide an Administrator Datastore using a journal backend."""
+
+    def __init__(self, data_dir, compact_threshold=COMPACT_THRESHOLD):
+        self._data_dir = data_dir
+        self._journal_dir = self._data_dir / JOURNAL_DIR
+        self._episode_dir = self._data_dir / EPISODE_DIR
+        self._lock_file = self._journal_dir / LOCK_FILE
+
+        self._journal_dir.mkdir(exist_ok=True, parents=True)
+        self._episode_dir.mkdir(exist_ok=True, parents=True)
+
+        # Shared with the compaction thread; only used while holding the lock file.
+        self._reader = JournalReader(self._journal_dir)
+        self._compact_threshold = compact_threshold
+        self._compaction = None
+
+    def _write_segment(self, segment, podcast_data):
+        """Write a new snapshot and empty journal pair, then point readers at it."""
+
+        files.write_json(self._journal_dir / snapshot_name(segment), podcast_data)
+
+        with open(self._journal_dir / journal_name(segment), "wb") as file:
+            os.fsync(file.fileno())
+
+        files.write_text(self._journal_dir / CURRENT, str(segment))
+
+    def _remove_segment(self, segment):
+
+        for name in [snapshot_name(segment), journal_name(segment)]:
+            (self._journal_dir / name).unlink(missing_ok=True)
+
+    def _append(self, *records, check=None):
+        """
+        Append records to the journal, in a single write.
+
+        check, if given, is called with the up to date podcast data and its EpisodeIndex before anything is written, and may raise to refuse the change.  Without one, the catalog isn't read at all, so the append costs the same however large the catalog is.
+        """
+
+        lines = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+        with files.locked(self._lock_file):
+
+            if check is None:
+                segment = read_segment(self._journal_dir)
+            else:
+                self._reader.refresh()
+                check(self._reader.podcast_data, self._reader.index)
+                segment = self._reader.segment
+
+            fd = os.open(self._journal_dir / journal_name(segment), os.O_RDWR | os.O_APPEND)
+
+            try:
+                truncate_partial_record(fd)
+                os.write(fd, lines)
+                os.fsync(fd)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+        if size >= self._compact_threshold:
+            self.compact_in_background()
+
+    def compact(self):
+        """Fold the journal into a new snapshot."""
+
+        with files.locked(self._lock_file):
+            self._reader.refresh()
+
+            previous = self._reader.segment
+
+            if self._reader.records == 0:
+                return
+
+            self._write_segment(previous + 1, self._reader.podcast_data)
+            self._remove_segment(previous)
+
+    def compact_in_background(self):
+        """Start compacting in a separate thread, unless that is already underway."""
+
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+
+        # Not a daemon: a short-lived CLI process waits for compaction to finish before exiting.
+        self._compaction = threading.Thread(target=self.compact, name="opp-journal-compaction")
+        self._compaction.start()
+
+    def initialize_channel(self, title, link, description, image, author, email, language, category, explicit, keywords):
+        """Initialize a new channel."""
+
+        channel_data = {
+            "title": title,
+            "link": link,
+            "description": description,
+            "image": image,
+            "author": author,
+            "email": email,
+            "language": language,
+            "category": category,
+            "explicit": explicit,
+            "keywords": keywords
+        }
+
+        with files.locked(self._lock_file):
+
+            try:
+                self._reader.refresh()
+                previous = self._reader.segment
+            except FileNotFoundError:
+                previous = None
+
+            segment = 1 if previous is None else previous + 1
+            self._write_segment(segment, {"channel": channel_data, "episodes": []})
+
+            if previous is not None:
+                self._remove_segment(previous)
+
+    def get_channel(self):
+        """Produce the podcast.Channel."""
+
+        with files.locked(self._lock_file):
+            self._reader.refresh()
+            return data_to_channel(self._reader.podcast_data["channel"])
+
+    def update_channel(self, title, link, description, image, author, email, language, category, explicit, keywords):
+        """Update the externally stored podcast channel information."""
+
+        chdata = {
+            "title": title,
+            "link": link,
+            "description": description,
+            "image": image,
+            "author": author,
+            "email": email,
+            "language": language,
+            "category": category,
+            "explicit": explicit,
+            "keywords": keywords
+        }
+
+        self._append({"op": "channel", "channel": chdata})
+
+    def create_episode(self, input_file_handle, title, description, guid, duration, publication_date, audio_format, length):
+        """Save a new episode."""
+
+        ep_data = store_episode(self._episode_dir, input_file_handle, title, description, guid, duration, publication_date, audio_format)
+        self._append({"op": "create", "episode": ep_data})
+
+    def create_episodes(self, episodes):
+        """Save several new episodes, with a single append to the journal."""
+
+        new_episodes = store_episodes(self._episode_dir, episodes)
+
+        if new_episodes:
+            self._append(*({"op": "create", "episode": ep_data} for ep_data in new_episodes))
+
+    def transaction(self):
+        """Provide a Transaction, whose changes are stored with a single append to the journal once the block completes."""
+        return transaction(self._episode_dir, self._commit)
+
+    def _commit(self, records):
+        deleted = []
+
+        def check(podcast_data, index):
+            # Try the changes in order on a copy, so a change to an episode created or deleted earlier in the batch is checked too.
+            scratch = EpisodeIndex(list(index.episodes))
+            deleted[:] = [ep_data for record, ep_data in zip(records, map(scratch.apply, records)) if record["op"] == "delete"]
+
+        self._append(*records, check=check)
+
+        return deleted
+
+    def audio_file_path(self, guid, audio_format):
+        """Produce the path name for an episode."""
+        return files.audio_file_path(self._episode_dir, guid, audio_format)
+
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """Produce an iterable of podcast.Episodes, newest first."""
+
+        with files.locked(self._lock_file):
+            self._reader.refresh()
+            episodes = select(self._reader.podcast_data["episodes"], offset, limit, since, published=lambda ep: date.fromisoformat(ep["publication_date"]))
+
+        return [data_to_episode(ep) for ep in episodes]
+
+    def update_episode(self, guid, **kwargs):
+        """
+        Update an existing episode.
+
+        Required:
+            - guid - str, episode global identifier
+
+        Optional:
+            - title
+            - description
+            - duration
+            - publication_date
+
+        Return: None
+        """
+
+        self._append({"op": "update", "guid": guid, "changes": episode_changes(**kwargs)}, check=lambda podcast_data, index: index.find(guid))
+
+    def delete_episode(self, guid):
+        """Delete an episode."""
+
+        found = []
+        self._append({"op": "delete", "guid": guid}, check=lambda podcast_data, index: found.append(index.find(guid)))
+
+        # Only remove the audio once the catalog no longer refers to it.
+        Path(found[0]["path"]).unlink()
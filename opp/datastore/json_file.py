@@ -1,58 +1,104 @@
 # -*- coding: utf-8 -*-
 
-from datetime import date
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 import json
-import uuid
+import os
+import time
 
-import opp.podcast as podcast
 import opp.visitor as visitor
 import opp.administrator as adm
+from opp.datastore.catalog import ColumnarCatalog, EpisodeIndex, order_key, select
+from opp.datastore.common import data_to_channel, data_to_episode, episode_changes, store_episode, store_episodes, transaction
+import opp.datastore.files as files
 
 from pathlib import Path
 
 
 OPP_JSON = "opp.json"
+LOCK_FILE = "opp.json.lock"
 EPISODE_DIR = "episodes/"
 
 
-def data_to_episode(ep_data):
-    """Convert the JSON data to an Episode object."""
+class VisitorDS(visitor.PodcastDatastore):
 
-    episode = podcast.Episode(ep_data["title"], ep_data["description"], uuid.UUID(ep_data["guid"]), ep_data["duration"], date.fromisoformat(ep_data["publication_date"]), podcast.AudioFormat(ep_data["audio_format"]), Path(ep_data["path"]), ep_data["length"])
-    return episode
+    """
+    Provide a visitor Datastore using a JSON file backend.
 
+    The catalog is held as an immutable, columnar snapshot, see ColumnarCatalog.  On access, at most once every check_interval seconds, the JSON file is stat'ed and a fresh snapshot is swapped in if it changed.  reload() forces the next access to re-read the file, and is safe to call from a signal handler.
+    """
 
-class VisitorDS(visitor.PodcastDatastore):
+    def __init__(self, data_dir, check_interval=1.0):
+        self._opp_json = data_dir / OPP_JSON
+        self._episode_dir = data_dir / EPISODE_DIR
 
-    """Provide a visitor Datastore using a JSON file backend."""
+        self._check_interval = check_interval
+        self._next_check = time.monotonic() + check_interval
+        self._forced = False
 
-    def __init__(self, data_dir):
+        self._catalog = self._load()
+
+    def _load(self):
+        """Read the JSON file into a new catalog snapshot."""
 
-        with open(data_dir / OPP_JSON, "r") as file:
+        with open(self._opp_json, "r") as file:
+            stat = os.fstat(file.fileno())
             podcast_data = json.load(file)
 
-        channel_data = podcast_data["channel"]
-        self._channel = podcast.Channel(channel_data["title"], channel_data["link"], channel_data["description"], channel_data["image"], channel_data["author"], channel_data["email"], channel_data["language"], channel_data["category"], channel_data["explicit"], channel_data["keywords"])
+        channel = data_to_channel(podcast_data["channel"])
 
-        episode_data = podcast_data["episodes"]
-        self._episodes = [data_to_episode(ep) for ep in episode_data]
-        self._episode_dir = data_dir / EPISODE_DIR
+        stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+        return ColumnarCatalog(channel, podcast_data.get("episodes", []), stamp=stamp, modified=modified)
+
+    def _current(self):
+        """Produce the current catalog snapshot, replacing it first if the JSON file has changed."""
+
+        catalog = self._catalog
+        now = time.monotonic()
+
+        if now < self._next_check and not self._forced:
+            return catalog
+
+        self._next_check = now + self._check_interval
+        forced, self._forced = self._forced, False
+
+        try:
+            stat = self._opp_json.stat()
+        except OSError:
+            return catalog
+
+        if not forced and (stat.st_ino, stat.st_size, stat.st_mtime_ns) == catalog.stamp:
+            return catalog
+
+        try:
+            catalog = self._load()
+        except (OSError, ValueError, KeyError):
+            # Mid-write or otherwise unreadable; keep serving the last good snapshot.
+            return catalog
+
+        self._catalog = catalog
+        return catalog
+
+    def reload(self):
+        """Re-read the catalog on the next access, even if the file looks unchanged."""
+        self._forced = True
 
     def get_channel(self):
-        return self._channel
+        return self._current().channel
 
-    def get_episodes(self):
-        return self._episodes
+    def get_episodes(self, offset=0, limit=None, since=None):
+        return self._current().select(offset, limit, since)
 
     def get_episode(self, guid):
-        guids = [str(ep.guid) for ep in self._episodes]
+        return self._current().get_episode(guid)
 
-        try:
-            idx = guids.index(guid)
-        except ValueError:
-            return
+    def catalog_version(self):
+        return self._current().version
 
-        return self._episodes[idx]
+    def catalog_modified(self):
+        return self._current().modified
 
     @property
     def episode_dir(self):
@@ -66,6 +112,7 @@ class AdminDS(adm.PodcastDatastore):
     def __init__(self, data_dir):
         self._data_dir = data_dir
         self._opp_json = self._data_dir / OPP_JSON
+        self._lock_file = self._data_dir / LOCK_FILE
         self._episode_dir = self._data_dir / EPISODE_DIR
 
         self._episode_dir.mkdir(exist_ok=True, parents=True)
@@ -89,26 +136,46 @@ class AdminDS(adm.PodcastDatastore):
             }
         }
 
-        with open(self._opp_json, "w") as file:
-            json.dump(channel_data, file)
+        with files.locked(self._lock_file):
+            files.write_json(self._opp_json, channel_data)
 
-    def get_channel(self):
-        """Produce the podcast.Channel."""
+    def _read(self):
+        """Load the podcast data as stored."""
 
         with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
-            chdata = podcast_data["channel"]
+            return json.load(file)
+
+    @contextmanager
+    def _modify(self):
+        """
+        Provide the stored podcast data for a read-modify-write cycle.
+
+        Other writers are locked out until the modified data has been written back.  Readers don't take the lock; they see the old file until the new one atomically replaces it.
+        """
 
-        channel = podcast.Channel(chdata["title"], chdata["link"], chdata["description"], chdata["image"], chdata["author"], chdata["email"], chdata["language"], chdata["category"], chdata["explicit"], chdata["keywords"])
+        with files.locked(self._lock_file):
+            podcast_data = self._read()
+            yield podcast_data
+            files.write_json(self._opp_json, podcast_data)
 
-        return channel
+    @contextmanager
+    def _modify_episodes(self):
+        """Provide the stored episodes as an EpisodeIndex, for a read-modify-write cycle as _modify does."""
+
+        with self._modify() as podcast_data:
+
+            if type(podcast_data.get("episodes")) is not list:
+                podcast_data["episodes"] = []
+
+            yield EpisodeIndex(podcast_data["episodes"])
+
+    def get_channel(self):
+        """Produce the podcast.Channel."""
+        return data_to_channel(self._read()["channel"])
 
     def update_channel(self, title, link, description, image, author, email, language, category, explicit, keywords):
         """Update the externally stored podcast channel information."""
 
-        with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
-
         chdata = {
             "title": title,
             "link": link,
@@ -122,70 +189,55 @@ class AdminDS(adm.PodcastDatastore):
             "keywords": keywords
         }
 
-        podcast_data["channel"] = chdata
-
-        with open(self._opp_json, "w") as file:
-            json.dump(podcast_data, file)
+        with self._modify() as podcast_data:
+            podcast_data["channel"] = chdata
 
     def create_episode(self, input_file_handle, title, description, guid, duration, publication_date, audio_format, length):
         """Save a new episode."""
 
-        audio_file_path = self.audio_file_path(guid, audio_format)
+        ep_data = store_episode(self._episode_dir, input_file_handle, title, description, guid, duration, publication_date, audio_format)
+        self._add_episodes([ep_data])
 
-        with open(audio_file_path, "wb") as file:
-            file.write(input_file_handle.read())
+    def create_episodes(self, episodes):
+        """Save several new episodes, with a single rewrite of the catalog."""
+        self._add_episodes(store_episodes(self._episode_dir, episodes))
 
-        ep_data = {
-            "title": title,
-            "description": description,
-            "guid": guid,
-            "duration": duration,
-            "publication_date": publication_date.isoformat(),
-            "audio_format": audio_format,
-            "path": str(audio_file_path),
-            "length": length
-        }
+    def _add_episodes(self, new_episodes):
 
-        with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
+        with self._modify_episodes() as index:
 
-        if type(podcast_data.get("episodes")) is list:
-            podcast_data["episodes"].append(ep_data)
-        else:
-            podcast_data["episodes"] = [ep_data]
+            for ep_data in new_episodes:
+                index.insert(ep_data)
 
-        podcast_data["episodes"].sort(key=lambda ep: ep["publication_date"], reverse=True)
+    def transaction(self):
+        """Provide a Transaction, whose changes are stored with a single rewrite of the catalog once the block completes."""
+        return transaction(self._episode_dir, self._commit)
 
-        with open(self._opp_json, "w") as file:
-            json.dump(podcast_data, file)
+    def _commit(self, records):
 
-    def audio_file_path(self, guid, audio_format):
-        """Produce the path name for an episode."""
-
-        af = podcast.AudioFormat(audio_format)
-
-        if af == podcast.AudioFormat.OggOpus:
-            ext = "opus"  # Looks wrong, but not.
-
-        elif af == podcast.AudioFormat.OggVorbis:
-            ext = "ogg"
+        with self._modify_episodes() as index:
+            changed = [index.apply(record) for record in records]
 
-        else:
-            ext = "mp3"
+        return [ep_data for record, ep_data in zip(records, changed) if record["op"] == "delete"]
 
-        return self._episode_dir / f"{guid}.{ext}"
+    def audio_file_path(self, guid, audio_format):
+        """Produce the path name for an episode."""
+        return files.audio_file_path(self._episode_dir, guid, audio_format)
 
-    def get_episodes(self):
-        """Produce an iterable of podcast.Episodes."""
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """Produce an iterable of podcast.Episodes, newest first."""
 
-        with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
+        podcast_data = self._read()
 
         if "episodes" in podcast_data:
-            episode_data = podcast_data["episodes"]
+            # Catalogs written before updates kept the order may need sorting; an ordered one costs a single pass.
+            episode_data = sorted(podcast_data["episodes"], key=order_key)
         else:
             episode_data = []
 
+        # Only the selected episodes are converted.
+        episode_data = select(episode_data, offset, limit, since, published=lambda ep: date.fromisoformat(ep["publication_date"]))
+
         return [data_to_episode(ep) for ep in episode_data]
 
     def update_episode(self, guid, **kwargs):
@@ -204,43 +256,14 @@ class AdminDS(adm.PodcastDatastore):
         Return: None
         """
 
-        with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
-
-        episodes = podcast_data.get("episodes", [])
-        guids = [ep["guid"] for ep in episodes]
-
-        select = guids.index(guid)
-
-        for attribute in ["title", "description", "duration"]:
-
-            if kwargs.get(attribute) is not None:
-                episodes[select][attribute] = kwargs[attribute]
-
-        if kwargs.get("publication_date") is not None:
-            episodes[select]["publication_date"] = kwargs["publication_date"].isoformat()
-
-        podcast_data["episodes"] = episodes
-
-        with open(self._opp_json, "w") as file:
-            json.dump(podcast_data, file)
+        with self._modify_episodes() as index:
+            index.update(guid, episode_changes(**kwargs))
 
     def delete_episode(self, guid):
         """Delete an episode."""
 
-        with open(self._opp_json, "r") as file:
-            podcast_data = json.load(file)
-
-        episodes = podcast_data.get("episodes", [])
-        guids = [ep["guid"] for ep in episodes]
-
-        select = guids.index(guid)
-
-        ep = episodes.pop(select)
-        ep_path = Path(ep["path"])
-        ep_path.unlink()
-
-        podcast_data["episodes"] = episodes
+        with self._modify_episodes() as index:
+            ep = index.delete(guid)
 
-        with open(self._opp_json, "w") as file:
-            json.dump(podcast_data, file)
+        # Only remove the audio once the catalog no longer refers to it.
+        Path(ep["path"]).unlink()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import opp.podcast as podcast
+import opp.visitor as visitor
+import opp.administrator as adm
+import opp.datastore.files as files
+from opp.datastore.common import episode_changes, store_episode, store_episodes, transaction
+
+from pathlib import Path
+
+
+"""
+SQLite datastore backend.
+
+Episodes are indexed by guid and publication date, so lookups and ordered listings don't require the whole catalog in memory.  The database runs in WAL mode: visitors read without blocking the administrator's writes, and vice versa.  Every change bumps a generation counter, by trigger, which visitors use to notice changes cheaply.
+"""
+
+
+DATABASE = "opp.sqlite3"
+EPISODE_DIR = "episodes/"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    title TEXT NOT NULL,
+    link TEXT,
+    description TEXT,
+    image TEXT,
+    author TEXT,
+    email TEXT,
+    language TEXT,
+    category TEXT,
+    explicit INTEGER NOT NULL DEFAULT 0,
+    keywords TEXT
+);
+
+CREATE TABLE IF NOT EXISTS episodes (
+    guid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    duration INTEGER,
+    publication_date TEXT NOT NULL,
+    audio_format TEXT NOT NULL,
+    path TEXT NOT NULL,
+    length INTEGER,
+    sha256 TEXT
+);
+
+CREATE INDEX IF NOT EXISTS episodes_publication_date ON episodes (publication_date DESC);
+
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    modified TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO generation (id, version, modified) VALUES (1, 0, strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'));
+"""
+
+TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS {table}_{action}_generation AFTER {action} ON {table}
+BEGIN
+    UPDATE generation SET version = version + 1, modified = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now') WHERE id = 1;
+END;
+"""
+
+# Ties on publication date keep insertion order, matching the JSON backend's stable sort.
+EPISODE_ORDER = "ORDER BY publication_date DESC, rowid ASC"
+
+INSERT_EPISODE = "INSERT INTO episodes (guid, title, description, duration, publication_date, audio_format, path, length, sha256) VALUES (:guid, :title, :description, :duration, :publication_date, :audio_format, :path, :length, :sha256)"
+
+
+def connect(database, create=True):
+    """
+    Open a connection to the database.
+
+    With create, the database and its schema are created if need be.  Otherwise the database must already exist, and is only opened.
+    """
+
+    if not create:
+
+        if not Path(database).exists():
+            raise FileNotFoundError(f"No SQLite datastore at {database}; run 'opp initialize' or 'opp migrate-sqlite' with OPP_BACKEND=sqlite first.")
+
+        connection = sqlite3.connect(f"file:{database}?mode=rw", uri=True, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    connection = sqlite3.connect(database, timeout=30)
+    connection.row_factory = sqlite3.Row
+
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+
+    with connection:
+        connection.executescript(SCHEMA)
+
+        for table in ["channel", "episodes"]:
+
+            for action in ["INSERT", "UPDATE", "DELETE"]:
+                connection.executescript(TRIGGER.format(table=table, action=action))
+
+    return connection
+
+
+def select_episodes(connection, offset=0, limit=None, since=None):
+    """Query a page of episodes, newest first, using the publication date index."""
+
+    where = "WHERE publication_date >= ?" if since is not None else ""
+    parameters = (since.isoformat(),) if since is not None else ()
+
+    # A negative LIMIT means no limit in SQLite.
+    rows = connection.execute(f"SELECT * FROM episodes {where} {EPISODE_ORDER} LIMIT ? OFFSET ?", parameters + (-1 if limit is None else limit, offset))
+
+    return [row_to_episode(row) for row in rows]
+
+
+def apply_change(connection, change):
+    """
+    Make an episode change, given as a journal style record, see common.Transaction.
+
+    Return: the stored data of a deleted episode, otherwise None
+    """
+
+    op = change["op"]
+
+    if op == "create":
+        connection.execute(INSERT_EPISODE, change["episode"])
+        return
+
+    row = connection.execute("SELECT * FROM episodes WHERE guid = ?", (change["guid"],)).fetchone()
+
+    if row is None:
+        raise ValueError(f"{change['guid']} is not an episode")
+
+    if op == "update":
+
+        if change["changes"]:
+            assignments = ", ".join(f"{column} = ?" for column in change["changes"])
+            connection.execute(f"UPDATE episodes SET {assignments} WHERE guid = ?", (*change["changes"].values(), change["guid"]))
+
+    elif op == "delete":
+        connection.execute("DELETE FROM episodes WHERE guid = ?", (change["guid"],))
+        return dict(row)
+
+    else:
+        raise ValueError(f"Unknown episode operation '{op}'")
+
+
+def row_to_channel(row):
+    """Convert a channel row to a Channel object."""
+
+    keywords = json.loads(row["keywords"]) if row["keywords"] is not None else None
+    return podcast.Channel(row["title"], row["link"], row["description"], row["image"], row["author"], row["email"], row["language"], row["category"], bool(row["explicit"]), keywords)
+
+
+def row_to_episode(row):
+    """Convert an episode row to an Episode object."""
+    return podcast.Episode(row["title"], row["description"], uuid.UUID(row["guid"]), row["duration"], date.fromisoformat(row["publication_date"]), podcast.AudioFormat(row["audio_format"]), Path(row["path"]), row["length"])
+
+
+class Database:
+
+    """Hand out one connection per thread, since sqlite3 connections can't be shared between threads."""
+
+    def __init__(self, path, create=True):
+        self._path = path
+        self._create = create
+        self._local = threading.local()
+
+        connect(path, create).close()  # Create the schema, or check the database exists, up front.
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = connect(self._path, self._create)
+            self._local.connection = connection
+
+        return connection
+
+
+class VisitorDS(visitor.PodcastDatastore):
+
+    """
+    Provide a visitor Datastore using an SQLite backend.
+
+    Episodes are queried as needed.  The channel, and the generation of the database, are re-checked at most once every check_interval seconds.
+    """
+
+    def __init__(self, data_dir, check_interval=1.0):
+        # Visitors never create the database; that's up to the administrator.
+        self._database = Database(data_dir / DATABASE, create=False)
+        self._episode_dir = data_dir / EPISODE_DIR
+
+        self._check_interval = check_interval
+        self._next_check = 0
+        self._state = None  # (version, modified, channel)
+
+    def _current(self):
+        """Produce the (version, modified, channel) as of the last check."""
+
+        state = self._state
+        now = time.monotonic()
+
+        if state is not None and now < self._next_check:
+            return state
+
+        self._next_check = now + self._check_interval
+        connection = self._database.connection
+
+        version, modified = connection.execute("SELECT version, modified FROM generation WHERE id = 1").fetchone()
+
+        if state is None or state[0] != version:
+            row = connection.execute("SELECT * FROM channel WHERE id = 1").fetchone()
+
+            if row is None:
+                raise LookupError(f"The SQLite datastore at {self._database.path} has no channel; run 'opp initialize' or 'opp migrate-sqlite' first.")
+
+            state = (version, datetime.fromisoformat(modified), row_to_channel(row))
+            self._state = state
+
+        return state
+
+    def reload(self):
+        """Check for changes on the next access."""
+        self._next_check = 0
+
+    def get_channel(self):
+        return self._current()[2]
+
+    def get_episodes(self, offset=0, limit=None, since=None):
+        return select_episodes(self._database.connection, offset, limit, since)
+
+    def get_episode(self, guid):
+        row = self._database.connection.execute("SELECT * FROM episodes WHERE guid = ?", (guid,)).fetchone()
+
+        if row is None:
+            return
+
+        return row_to_episode(row)
+
+    def catalog_version(self):
+        return self._current()[0]
+
+    def catalog_modified(self):
+        return self._current()[1]
+
+    @property
+    def episode_dir(self):
+        return self._episode_dir
+
+
+class AdminDS(adm.PodcastDatastore):
+
+    """Provide an Administrator Datastore using an SQLite backend."""
+
+    def __init__(self, data_dir):
+        self._data_dir = data_dir
+        self._episode_dir = self._data_dir / EPISODE_DIR
+
+        self._episode_dir.mkdir(exist_ok=True, parents=True)
+        self._database = Database(self._data_dir / DATABASE)
+
+    def initialize_channel(self, title, link, description, image, author, email, language, category, explicit, keywords):
+        """Initialize a new channel."""
+
+        with self._database.connection as connection:
+            connection.execute("DELETE FROM channel")
+            connection.execute(
+                "INSERT INTO channel (id, title, link, description, image, author, email, language, category, explicit, keywords) VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (title, link, description, image, author, email, language, category, explicit, json.dumps(keywords) if keywords is not None else None)
+            )
+
+    def get_channel(self):
+        """Produce the podcast.Channel."""
+
+        row = self._database.connection.execute("SELECT * FROM channel WHERE id = 1").fetchone()
+        return row_to_channel(row)
+
+    def update_channel(self, title, link, description, image, author, email, language, category, explicit, keywords):
+        """Update the externally stored podcast channel information."""
+
+        with self._database.connection as connection:
+            connection.execute(
+                "UPDATE channel SET title = ?, link = ?, description = ?, image = ?, author = ?, email = ?, language = ?, category = ?, explicit = ?, keywords = ? WHERE id = 1",
+                (title, link, description, image, author, email, language, category, explicit, json.dumps(keywords) if keywords is not None else None)
+            )
+
+    def create_episode(self, input_file_handle, title, description, guid, duration, publication_date, audio_format, length):
+        """Save a new episode."""
+
+        ep_data = store_episode(self._episode_dir, input_file_handle, title, description, guid, duration, publication_date, audio_format)
+
+        with self._database.connection as connection:
+            connection.execute(INSERT_EPISODE, ep_data)
+
+    def create_episodes(self, episodes):
+        """Save several new episodes, in a single transaction."""
+
+        new_episodes = store_episodes(self._episode_dir, episodes)
+
+        with self._database.connection as connection:
+            connection.executemany(INSERT_EPISODE, new_episodes)
+
+    def audio_file_path(self, guid, audio_format):
+        """Produce the path name for an episode."""
+        return files.audio_file_path(self._episode_dir, guid, audio_format)
+
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """Produce an iterable of podcast.Episodes, newest first."""
+        return select_episodes(self._database.connection, offset, limit, since)
+
+    def update_episode(self, guid, **kwargs):
+        """
+        Update an existing episode.
+
+        Required:
+            - guid - str, episode global identifier
+
+        Optional:
+            - title
+            - description
+            - duration
+            - publication_date
+
+        Return: None
+        """
+
+        with self._database.connection as connection:
+            apply_change(connection, {"op": "update", "guid": guid, "changes": episode_changes(**kwargs)})
+
+    def delete_episode(self, guid):
+        """Delete an episode."""
+
+        with self._database.connection as connection:
+            ep_data = apply_change(connection, {"op": "delete", "guid": guid})
+
+        # Only remove the audio once the catalog no longer refers to it.
+        Path(ep_data["path"]).unlink()
+
+    def transaction(self):
+        """Provide a Transaction, whose changes are stored in a single SQLite transaction once the block completes."""
+        return transaction(self._episode_dir, self._commit)
+
+    def _commit(self, records):
+
+        with self._database.connection as connection:
+            deleted = [apply_change(connection, record) for record in records]
+
+        return [ep_data for ep_data in deleted if ep_data is not None]
+
+
+def migrate_json(data_dir):
+    """
+    Copy the channel and episodes from the JSON datastore in data_dir into an SQLite datastore alongside it.
+
+    Audio files stay where they are.  The channel and any episodes already in the database are left untouched, so the migration can be re-run safely without undoing changes made since through the SQLite backend.
+
+    Return: the number of episodes copied
+    """
+
+    with open(data_dir / "opp.json", "r") as file:
+        podcast_data = json.load(file)
+
+    channel = podcast_data["channel"]
+    episodes = podcast_data.get("episodes", [])
+
+    ds = AdminDS(data_dir)
+
+    with ds._database.connection as connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO channel (id, title, link, description, image, author, email, language, category, explicit, keywords) VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (channel["title"], channel["link"], channel["description"], channel["image"], channel["author"], channel["email"], channel["language"], channel["category"], channel["explicit"], json.dumps(channel["keywords"]) if channel["keywords"] is not None else None)
+        )
+
+        # Insert in catalog order, so that ties on publication date keep their JSON order.
+        cursor = connection.executemany(
+            "INSERT OR IGNORE INTO episodes (guid, title, description, duration, publication_date, audio_format, path, length, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(ep["guid"], ep["title"], ep["description"], ep["duration"], ep["publication_date"], ep["audio_format"], ep["path"], ep["length"], ep.get("sha256")) for ep in episodes]
+        )
+
+    return cursor.rowcount
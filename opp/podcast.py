@@ -12,6 +12,8 @@ Objects in this layer should expect to remain unchanged unless something fundame
 
 class Channel:
 
+    __slots__ = ("title", "link", "description", "image", "author", "email", "language", "category", "explicit", "keywords")
+
     def __init__(self, title, link, description, image, author, email=None, language="en", category="Comedy", explicit=False, keywords=None):
 
         self.title = title
@@ -51,6 +53,10 @@ class AudioFormat(enum.Enum):
 
 
 class Episode:
+
+    # A catalog holds one per episode; without an instance dict each is a fraction of the size.
+    __slots__ = ("title", "description", "guid", "duration", "publication_date", "audio_format", "path", "length")
+
     def __init__(self, title, description, guid, duration, publication_date, audio_format, path, length):
         """Describe an episode."""
 
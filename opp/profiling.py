@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime, timezone
+import json
+import os
+import re
+import time
+
+"""
+Opt-in profiling of slow web requests and CLI commands.
+
+Each request or command runs under cProfile.  Those that take longer than a threshold have their profile dumped, in pstats format, with a JSON file alongside describing what ran and against how large a catalog.  Load the dumps with pstats, snakeviz and the like.
+"""
+
+
+def parse_setting(value):
+    """
+    Produce the threshold, in seconds, described by an OPP_PROFILE value, or None if profiling is off.
+
+    Accepted: "slow:200ms", "slow:1.5s", "slow:2" (seconds), or "all" to keep every profile.
+    """
+
+    if not value:
+        return
+
+    if value == "all":
+        return 0.0
+
+    match = re.fullmatch(r"slow:(\d+(?:\.\d+)?)(ms|s)?", value.strip())
+
+    if match is None:
+        raise ValueError(f"Unknown OPP_PROFILE '{value}', expected e.g. 'slow:200ms' or 'all'")
+
+    threshold = float(match.group(1))
+
+    if match.group(2) == "ms":
+        threshold /= 1000
+
+    return threshold
+
+
+@contextmanager
+def profiled(name, threshold, directory, describe=dict):
+    """
+    Profile the enclosed code, keeping the profile if it took at least threshold seconds.
+
+    Required:
+        - name - what is being run, e.g. a route or a command, used in the file names
+        - threshold - seconds, or None to run without profiling
+        - directory - pathlib.Path, where profiles are dumped
+
+    Optional:
+        - describe - produces a dict of details for the JSON file; only called for slow runs
+    """
+
+    if threshold is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread.
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= threshold:
+
+            try:
+                details = describe()
+            except Exception as error:
+                # e.g. a command that failed before the catalog existed; the profile is still worth having.
+                details = {"describe_error": repr(error)}
+
+            dump(profiler, name, elapsed, directory, details)
+
+
+def dump(profiler, name, elapsed, directory, details):
+    """Write the profile and its description into directory."""
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    now = datetime.now(timezone.utc)
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "root"
+    base = directory / f"{now:%Y%m%dT%H%M%S.%f}-{os.getpid()}-{slug}-{round(elapsed * 1000)}ms"
+
+    profiler.dump_stats(f"{base}.prof")
+
+    with open(f"{base}.json", "w") as file:
+        json.dump(dict(details, name=name, seconds=elapsed, time=now.isoformat(), pid=os.getpid()), file, indent=2)
@@ -17,8 +17,15 @@ class PodcastDatastore(ABC):
         pass
 
     @abstractmethod
-    def get_episodes(self):
-        """Produce an iterable of podcast episodes."""
+    def get_episodes(self, offset=0, limit=None, since=None):
+        """
+        Produce an iterable of podcast episodes, newest first.
+
+        Optional:
+            - offset - number of episodes to skip
+            - limit - maximum number of episodes, or None for all of them
+            - since - datetime.date, leave out episodes published before it
+        """
         pass
 
     @abstractmethod
@@ -26,23 +33,51 @@ class PodcastDatastore(ABC):
         """Produce a specific episode based on the given guid (as a string)."""
         pass
 
+    def catalog_version(self):
+        """Produce a token that changes whenever the channel or episodes change, or None if the datastore cannot tell."""
+        return
+
+    def reload(self):
+        """Re-read the channel and episodes on next access, for datastores that hold on to them."""
+        return
+
+    def catalog_modified(self):
+        """Produce the datetime of the last change to the channel or episodes, or None if unknown."""
+        return
+
 
 class VisitPodcast:
 
     def __init__(self, loader):
         self.loader = loader
 
-    def podcast_data(self):
-        """Produce a dict of all fields needed to follow the podcast."""
+    def podcast_data(self, offset=0, limit=None, since=None):
+        """Produce a dict of all fields needed to follow the podcast, with the selected page of episodes."""
 
         channel = self.loader.get_channel()
-        episodes = self.loader.get_episodes()
+        episodes = self.loader.get_episodes(offset=offset, limit=limit, since=since)
 
         return {
             "channel": dict(channel),
             "episodes": [dict(ep) for ep in episodes]
         }
 
+    def reload(self):
+        """Have the catalog re-read on next access, if the datastore supports it."""
+        self.loader.reload()
+
+    def episode_count(self):
+        """Produce the number of episodes."""
+        return len(list(self.loader.get_episodes()))
+
+    def catalog_version(self):
+        """Produce a token that changes whenever the podcast data changes, or None."""
+        return self.loader.catalog_version()
+
+    def catalog_modified(self):
+        """Produce the datetime the podcast data last changed, or None."""
+        return self.loader.catalog_modified()
+
     def get_episode(self, guid):
         """Produce a dict of a specific episode, from the guid."""
         episode = self.loader.get_episode(guid)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from functools import partial
+from http import HTTPStatus
+import io
+import re
+import sys
+from urllib.parse import unquote_to_bytes, urlsplit
+from uuid import UUID
+
+from werkzeug.http import parse_etags, parse_if_range_header, parse_range_header
+
+import opp.web.app as web
+from opp.web.ranges import byte_ranges, content_range
+
+"""
+Asyncio server.
+
+Episode downloads are sent from the event loop with loop.sendfile, so each slow client costs an open socket rather than a worker thread or process.  Everything else (the home page, the feed, the image and the css) is handed to the Flask app on a worker thread, where pages come from its render cache.
+"""
+
+
+EPISODE_PATH = re.compile(r"^/episode/([^/.]+)\.([A-Za-z0-9]+)$")
+MAX_HEADER_SIZE = 16 * 1024
+IDLE_TIMEOUT = 60  # Seconds to wait for the next request on a kept-alive connection
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request:
+
+    """The parts of an HTTP request the server uses."""
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = url.query
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+
+        return connection != "close"
+
+
+async def read_request(reader):
+    """Read the next request's head, or produce None once the client has closed the connection."""
+
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return
+    except asyncio.LimitOverrunError:
+        raise BadRequest("Request header too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise BadRequest("Malformed request line")
+
+    headers = {}
+
+    for line in lines[1:]:
+
+        if not line:
+            continue
+
+        name, sep, value = line.partition(":")
+
+        if not sep:
+            raise BadRequest("Malformed header")
+
+        headers[name.strip().lower()] = value.strip()
+
+    return Request(method, target, version, headers)
+
+
+def response_head(status, headers):
+    """Produce the status line and headers of a response, as bytes."""
+
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_episode(request, writer, guid, app_state):
+    """Answer a request for an episode's audio, sending the file with loop.sendfile."""
+
+    try:
+        UUID(guid)
+    except ValueError:
+        return await send_simple(writer, 400, "Invalid episode id")
+
+    loop = asyncio.get_running_loop()
+    # The lookup may re-read the whole catalog; that mustn't hold up every other connection.
+    episode = await loop.run_in_executor(None, find_episode, app_state, guid)
+
+    if not episode:
+        return await send_simple(writer, 404, "Not found")
+
+    length = episode["length"]
+    headers = [
+        ("ETag", f'"{episode["guid"]}"'),
+        ("Cache-Control", web.IMMUTABLE),
+        ("Accept-Ranges", "bytes"),
+    ]
+
+    if parse_etags(request.headers.get("if-none-match")).contains(episode["guid"]):
+        writer.write(response_head(304, headers))
+        return await writer.drain()
+
+    status, start, stop = 200, 0, length
+    if_range = parse_if_range_header(request.headers.get("if-range"))
+
+    if if_range.etag is None and if_range.date is None or if_range.etag == episode["guid"]:
+        ranges = byte_ranges(parse_range_header(request.headers.get("range")), length)
+    else:
+        ranges = None
+
+    # Several ranges are rare from audio players; the whole file is a valid answer to them.
+    if ranges is not None and len(ranges) > 1:
+        ranges = None
+
+    if ranges == []:
+        headers.append(("Content-Range", f"bytes */{length}"))
+        return await send_simple(writer, 416, "Range not satisfiable", headers)
+
+    if ranges:
+        status, (start, stop) = 206, ranges[0]
+        headers.append(("Content-Range", content_range(start, stop, length)))
+
+    headers.append(("Content-Type", web.mime_type(episode["audio_format"])))
+    headers.append(("Content-Length", str(stop - start)))
+
+    if request.method == "HEAD":
+        writer.write(response_head(status, headers))
+        return await writer.drain()
+
+    # Opened before the head is sent, so audio deleted since the catalog was read is still a 404.
+    try:
+        file = await loop.run_in_executor(None, open, episode["path"], "rb")
+    except OSError:
+        return await send_simple(writer, 404, "Not found")
+
+    with file:
+        writer.write(response_head(status, headers))
+        await writer.drain()
+        sent = await loop.sendfile(writer.transport, file, start, stop - start)
+
+    web.metrics.count("opp_episode_bytes_total", (("guid", episode["guid"]),), sent)
+
+
+def find_episode(app_state, guid):
+    """Look an episode up, on a worker thread."""
+
+    with web.metrics.timed("get_episode"):
+        return app_state.visit_podcast.get_episode(guid)
+
+
+async def send_simple(writer, status, text, headers=()):
+    body = text.encode("utf-8")
+    writer.write(response_head(status, list(headers) + [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))]) + body)
+    await writer.drain()
+
+
+def wsgi_environ(request, writer):
+    """Produce the WSGI environ for a request, so the Flask app can answer it."""
+
+    host, port = writer.get_extra_info("sockname")[:2]
+    peer = writer.get_extra_info("peername")
+
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote_to_bytes(request.path).decode("latin-1"),
+        "QUERY_STRING": request.query,
+        "SERVER_NAME": str(host),
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": request.version,
+        "REMOTE_ADDR": peer[0] if peer else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in request.headers.items():
+        key = name.upper().replace("-", "_")
+
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+        else:
+            environ[f"HTTP_{key}"] = value
+
+    return environ
+
+
+def call_app(app, environ):
+    """Run the Flask app on a request, buffering the whole response."""
+
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = app(environ, start_response)
+
+    try:
+        body = b"".join(result)
+    finally:
+
+        if hasattr(result, "close"):
+            result.close()
+
+    status, headers = started
+
+    if not any(name.lower() == "content-length" for name, value in headers):
+        headers = headers + [("Content-Length", str(len(body)))]
+
+    return status, headers, body
+
+
+async def send_app_response(request, writer, app):
+    """Answer a request through the Flask app, on a worker thread."""
+
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(None, call_app, app, wsgi_environ(request, writer))
+
+    writer.write(response_head(status, headers))
+
+    if request.method != "HEAD":
+        writer.write(body)
+
+    await writer.drain()
+
+
+async def handle_connection(app, reader, writer):
+    """Answer requests on a connection until the client closes it or asks to."""
+
+    try:
+
+        while True:
+
+            try:
+                request = await read_request(reader)
+            except BadRequest as error:
+                await send_simple(writer, 400, str(error), [("Connection", "close")])
+                break
+
+            if request is None:
+                break
+
+            if request.method not in ("GET", "HEAD"):
+                # Any request body is left unread, so the connection can't be reused.
+                await send_simple(writer, 405, "Method not allowed", [("Allow", "GET, HEAD"), ("Connection", "close")])
+                break
+
+            match = EPISODE_PATH.match(request.path)
+
+            if match is not None:
+                await send_episode(request, writer, match.group(1), web.state(app))
+            else:
+                await send_app_response(request, writer, app)
+
+            if not request.keep_alive:
+                break
+
+    except OSError:
+        pass  # Including the client going away mid-response.
+
+    finally:
+        writer.close()
+
+
+async def start(host="127.0.0.1", port=8000, app=None):
+    """Start listening, producing the asyncio Server.  app is the Flask app to serve; a new one by default."""
+
+    if app is None:
+        app = web.create_app()
+
+    return await asyncio.start_server(partial(handle_connection, app), host, port, limit=MAX_HEADER_SIZE)
+
+
+def serve(host="127.0.0.1", port=8000, app=None):
+    """Serve the podcast until interrupted."""
+
+    async def main():
+        server = await start(host, port, app)
+
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
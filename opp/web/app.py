@@ -2,13 +2,92 @@
 # -*- coding: utf-8 -*-
 
 import flask
+from pathlib import Path
+import signal
+import threading
+import time
+from types import MappingProxyType
+from urllib.parse import quote
 from uuid import UUID
-import markdown2
 
-import opp.config as config
+import opp.config
+import opp.profiling as profiling
+from opp.web.cache import MarkdownCache, RenderCache, RenderedPage
+from opp.web.metrics import CONTENT_TYPE, REGISTRY as metrics, serve_in_background
+from opp.web.ranges import Multipart, byte_ranges, content_range, file_range
 
-config.init_visitor()
-app = flask.Flask(__name__)
+"""
+The Flask web interface.
+
+create_app() builds the app without reading the catalog or importing the markdown renderer; both happen on first use, or up front with preload, e.g. in a prefork server's master process so that workers share the loaded catalog copy-on-write.
+"""
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+metrics_server = None
+
+
+def render_markdown(text):
+    "Render markdown to html, importing the renderer on first use."
+    import markdown2
+
+    return markdown2.markdown(text)
+
+
+class PodcastState:
+
+    """
+    Everything an app instance serves from: its configuration, the visitor use case and the caches built from it.
+
+    The use case, and so the catalog, is only loaded on first use.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.rendered_pages = RenderCache()
+        self.podcast_views = RenderCache()
+        self.rendered_markdown = MarkdownCache(render_markdown)
+        self.seen_version = None
+        # Parsed once, so a bad OPP_PROFILE fails creating the app rather than every request.
+        self.profile_threshold = config.profile_threshold()
+
+        self._visit_podcast = None
+        self._lock = threading.Lock()
+
+    @property
+    def visit_podcast(self):
+        visit_podcast = self._visit_podcast
+
+        if visit_podcast is None:
+
+            with self._lock:
+
+                if self._visit_podcast is None:
+                    self._visit_podcast = self.config.visit_podcast()
+
+                visit_podcast = self._visit_podcast
+
+        return visit_podcast
+
+    def load(self):
+        """Load the catalog now, rather than on the first request."""
+        self.visit_podcast.catalog_version()
+
+    def reload(self):
+        """Have the catalog re-read on the next access, if it has been loaded.  Safe to call from a signal handler."""
+
+        if self._visit_podcast is not None:
+            self._visit_podcast.reload()
+
+    def clear(self):
+        """Drop the cached views and pages."""
+        self.rendered_pages.clear()
+        self.podcast_views.clear()
+
+
+def state(app=None):
+    "Produce the PodcastState of the given app, or of the current one."
+    return (app or flask.current_app).extensions["opp"]
 
 
 def download_extension(audio_format):
@@ -36,28 +115,221 @@ def mime_type(audio_format):
 
 def episode_url(episode):
     "Pdocuce episode url."
-    return app.url_for("download_episode", guid=episode["guid"], ext=download_extension(episode["audio_format"]), _external=True)
+    return flask.url_for("download_episode", guid=episode["guid"], ext=download_extension(episode["audio_format"]), _external=True)
+
+
+def image_extension(image):
+    "Produce the file extension of the channel image, or None."
+
+    if image is None:
+        return
+
+    return Path(image).suffix.lstrip(".").lower() or None
+
+
+def image_url(channel, external=False):
+    "Produce the channel image url, carrying the image's own extension so that static servers can tell its type."
+
+    ext = image_extension(channel["image"])
+
+    if ext is None:
+        return flask.url_for("podcast_image", _external=external)
+
+    return flask.url_for("podcast_image", ext=ext, _external=external)
 
 
 def episode_data(episode):
     return dict(episode, url=episode_url(episode), mime_type=mime_type(episode["audio_format"]))
 
 
-@app.template_filter("markdown")
+class PodcastView:
+
+    """
+    Read-only presentation model of the podcast: the channel, and a page of episodes with their urls and mime types.
+
+    more tells whether there are older episodes past the page.
+    """
+
+    def __init__(self, channel, episodes, more=False):
+        self.channel = MappingProxyType(dict(channel))
+        self.episodes = tuple(MappingProxyType(episode_data(ep)) for ep in episodes)
+        self.more = more
+
+
+def catalog_version():
+    """Produce the current catalog version, counting the changes seen and the time spent checking for them."""
+
+    app_state = state()
+
+    with metrics.timed("catalog_version"):
+        version = app_state.visit_podcast.catalog_version()
+
+    if version != app_state.seen_version:
+
+        if app_state.seen_version is not None:
+            metrics.count("opp_catalog_reloads_total")
+
+        app_state.seen_version = version
+
+    return version
+
+
+def podcast_view(offset=0, limit=None):
+    """
+    Produce the PodcastView of a page of episodes, for the current catalog version and the request's url root.
+
+    The view is built once per catalog version, url root and page, so steady-state requests do no per-episode work.
+    """
+
+    app_state = state()
+    visit_podcast = app_state.visit_podcast
+    version = catalog_version()
+    key = (flask.request.url_root, offset, limit)
+
+    view = app_state.podcast_views.get(version, key)
+
+    if view is not None:
+        return view
+
+    # Ask for one episode past the page, to tell whether there is a next one.
+    with metrics.timed("podcast_data"):
+        data = visit_podcast.podcast_data(offset=offset, limit=limit + 1 if limit is not None else None)
+    episodes = data["episodes"]
+    more = limit is not None and len(episodes) > limit
+
+    view = PodcastView(data["channel"], episodes[:limit], more)
+
+    if not app_state.podcast_views.has_version(version):
+        # First view since the catalog changed; get the markdown out of the way for every page at once.
+        warm_markdown(view.channel, view.episodes)
+
+    # Only keep the view if the catalog did not change while it was being built.
+    if catalog_version() == version:
+        app_state.podcast_views.put(version, key, view)
+
+    return view
+
+
+def rendered_response(template, mimetype, page=1, page_size=None):
+    """
+    Produce a response for a template rendered from the podcast data.
+
+    Optional:
+        - page - number of the page of episodes, from 1
+        - page_size - episodes per page, or None for all of them on a single page
+
+    The rendered bytes, and their compressed variants, are reused until the catalog changes, and requests carrying a matching If-None-Match or If-Modified-Since are answered with 304.  A page past the last one is answered with 404.
+    """
+
+    app_state = state()
+    visit_podcast = app_state.visit_podcast
+    version = catalog_version()
+    key = (template, flask.request.url_root, page, page_size)
+
+    page_data = app_state.rendered_pages.get(version, key)
+
+    if page_data is None:
+        modified = visit_podcast.catalog_modified()
+        offset = (page - 1) * page_size if page_size is not None else 0
+        view = podcast_view(offset, page_size)
+
+        if page > 1 and not view.episodes:
+            return flask.Response(response="Not found", status=404)
+
+        newer = page - 1 if page > 1 else None
+        older = page + 1 if view.more else None
+
+        body = flask.render_template(template, channel=view.channel, episodes=view.episodes, newer_page=newer, older_page=older).encode("utf-8")
+        page_data = RenderedPage(body, modified)
+
+        # Only keep the page if the catalog did not change while it was being rendered.
+        if catalog_version() == version:
+            app_state.rendered_pages.put(version, key, page_data)
+
+    coding, body, etag = page_data.negotiate(flask.request.accept_encodings)
+
+    response = flask.Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+
+    if coding != "identity":
+        response.content_encoding = coding
+
+    if page_data.modified is not None:
+        response.last_modified = page_data.modified
+
+    return response.make_conditional(flask.request)
+
+
+def warm_markdown(channel, episodes):
+    "Render the channel and episode descriptions into the markdown cache."
+
+    rendered_markdown = state().rendered_markdown
+    rendered_markdown(channel["description"])
+
+    for episode in episodes:
+        rendered_markdown(episode["description"])
+
+
+def start_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+def start_profile():
+    "Profile the request, if OPP_PROFILE asks for slow requests to be captured."
+
+    app_state = state()
+
+    if app_state.profile_threshold is None:
+        return
+
+    request = flask.request
+
+    def describe():
+        return {"route": request.endpoint, "path": request.full_path, "episodes": app_state.visit_podcast.episode_count()}
+
+    flask.g.profile = profiling.profiled(f"web-{request.endpoint}", app_state.profile_threshold, app_state.config.profile_dir(), describe)
+    flask.g.profile.__enter__()
+
+
+def finish_profile(error=None):
+    profile = flask.g.pop("profile", None)
+
+    if profile is not None:
+        profile.__exit__(None, None, None)
+
+
+def record_request(response):
+    "Count the request, its duration, and any episode audio sent."
+
+    request = flask.request
+    route = request.endpoint or "unmatched"
+
+    metrics.count("opp_requests_total", (("route", route), ("method", request.method), ("status", str(response.status_code))))
+
+    if "request_start" in flask.g:
+        metrics.observe("opp_request_duration_seconds", (("route", route),), time.perf_counter() - flask.g.request_start)
+
+    # Offloaded downloads are sent by the front-end server, and counted there.
+    if route == "download_episode" and request.method == "GET" and response.status_code in (200, 206) and response.content_length:
+        metrics.count("opp_episode_bytes_total", (("guid", request.view_args["guid"]),), response.content_length)
+
+    return response
+
+
 def markdown(text):
-    return markdown2.markdown(text)
+    return state().rendered_markdown(text)
 
 
-@app.route("/")
 def home():
-    data = config.VISIT_PODCAST.podcast_data()
-    channel = data["channel"]
-    episodes = [episode_data(ep) for ep in data["episodes"]]
+    page = flask.request.args.get("page", 1, type=int)
 
-    return flask.render_template("podcast.html", channel=channel, episodes=episodes)
+    if page < 1:
+        return flask.Response(response="Not found", status=404)
+
+    return rendered_response("podcast.html", "text/html", page=page, page_size=state().config.page_size())
 
 
-@app.route("/episode/<guid>.<ext>", methods=["GET", "HEAD"])
 def download_episode(guid, ext="mp3"):
     """Produce the audio file for a given episode."""
 
@@ -66,26 +338,106 @@ def download_episode(guid, ext="mp3"):
     except ValueError:
         return flask.Response(response="Invalid episode id", status=400)
 
-    episode = config.VISIT_PODCAST.get_episode(guid)
+    with metrics.timed("get_episode"):
+        episode = state().visit_podcast.get_episode(guid)
 
     if not episode:
         return flask.Response(response="Not found", status=404)
 
-    result = flask.send_file(episode["path"], mimetype=mime_type(episode["audio_format"]))
-    result.accept_ranges = "bytes"
+    # Episode audio never changes once stored, so the guid alone identifies its content.
+    if flask.request.if_none_match.contains(episode["guid"]):
+        response = flask.Response(status=304)
+        audio_headers(response, episode)
+        return response
+
+    header = state().config.sendfile_header()
+
+    if header is not None:
+        response = offloaded_download(episode, header)
+    else:
+        response = audio_response(episode)
+
+    audio_headers(response, episode)
+    return response
+
+
+def audio_headers(response, episode):
+    "Mark an episode audio response as cacheable forever."
+    response.set_etag(episode["guid"])
+    response.headers["Cache-Control"] = IMMUTABLE
+
+
+def audio_response(episode):
+    """
+    Produce the episode's audio, or the requested byte ranges of it.
 
-    if flask.request.method == "HEAD" or flask.request.method == "GET":
-        return result
+    HEAD requests are answered from the stored length and mime type alone.  Full GETs use send_file, so that servers able to send files efficiently can do so; ranges are read from the file as the body is sent.
+    """
 
-    return flask.Response(response="Invalid request", status=400)
+    request = flask.request
+    length = episode["length"]
+    mimetype = mime_type(episode["audio_format"])
 
+    ranges = None
 
-@app.route("/image")
-def podcast_image():
+    if request.if_range.etag is None and request.if_range.date is None or request.if_range.etag == episode["guid"]:
+        ranges = byte_ranges(request.range, length)
+
+    if ranges is None:
+
+        if request.method == "HEAD":
+            response = flask.Response(mimetype=mimetype)
+            response.content_length = length
+        else:
+            response = flask.send_file(episode["path"], mimetype=mimetype, conditional=False, etag=False, last_modified=None)
+
+        response.accept_ranges = "bytes"
+        return response
+
+    if not ranges:
+        response = flask.Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{length}"
+        return response
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+
+        response = flask.Response(file_range(episode["path"], start, stop), status=206, mimetype=mimetype)
+        response.headers["Content-Range"] = content_range(start, stop, length)
+        response.content_length = stop - start
+
+    else:
+        body = Multipart(episode["path"], ranges, length, mimetype)
+
+        response = flask.Response(body, status=206, content_type=body.content_type)
+        response.content_length = body.length
+
+    response.accept_ranges = "bytes"
+    return response
+
+
+def offloaded_download(episode, header):
+    """
+    Produce an empty response that has the front-end server send the episode's audio itself.
+
+    X-Sendfile carries the file's path.  X-Accel-Redirect carries a URI in an nginx internal location, aliased to the episode directory.
+    """
+
+    if header == "X-Accel-Redirect":
+        target = state().config.sendfile_prefix().rstrip("/") + "/" + quote(Path(episode["path"]).name)
+    else:
+        target = str(episode["path"])
+
+    response = flask.Response(mimetype=mime_type(episode["audio_format"]))
+    response.headers[header] = target
+
+    return response
+
+
+def podcast_image(ext=None):
     """Produce the podcast image, if available."""
 
-    data = config.VISIT_PODCAST.podcast_data()
-    image = data["channel"]["image"]
+    image = podcast_view().channel["image"]
 
     if image is None:
         return flask.Response(response="Not found", status=404)
@@ -93,25 +445,84 @@ def podcast_image():
     return flask.send_file(image)
 
 
-@app.route("/rss.xml")
 def rss():
-    data = config.VISIT_PODCAST.podcast_data()
+    return rendered_response("podcast.xml", "application/rss+xml", page_size=state().config.feed_limit())
+
 
-    channel = data["channel"]
-    episodes = [episode_data(ep) for ep in data["episodes"]]
+def prometheus_metrics():
+    """Produce the metrics, unless they are served on their own port, or this is one of several podcasts in the process."""
 
-    xml = flask.render_template("podcast.xml", channel=channel, episodes=episodes)
+    if not state().config.app_metrics():
+        return flask.Response(response="Not found", status=404)
 
-    return flask.Response(xml, mimetype="application/rss+xml")
+    return flask.Response(metrics.render(), content_type=CONTENT_TYPE)
 
 
-@app.route("/style.css")
 def css():
     """Produce the custom css, if available."""
 
-    css = config.css_file()
+    css = state().config.css_file()
 
     if css.exists():
-        flask.send_file(css, mimetype="text/css")
+        return flask.send_file(css, mimetype="text/css")
 
     return flask.Response(response="Not found", status=404)
+
+
+def create_app(config=opp.config, preload=False):
+    """
+    Produce a Flask app serving the podcast.
+
+    Optional:
+        - config - provides the settings, as the opp.config module does
+        - preload - load the catalog now rather than on the first request
+    """
+
+    global metrics_server
+
+    app = flask.Flask(__name__)
+    app_state = PodcastState(config)
+    app.extensions["opp"] = app_state
+
+    app.add_template_global(image_url)
+    app.add_template_filter(markdown, "markdown")
+
+    app.before_request(start_timer)
+    app.before_request(start_profile)
+    app.teardown_request(finish_profile)
+    app.after_request(record_request)
+
+    app.add_url_rule("/", view_func=home)
+    app.add_url_rule("/episode/<guid>.<ext>", view_func=download_episode, methods=["GET", "HEAD"])
+    app.add_url_rule("/image", view_func=podcast_image)
+    app.add_url_rule("/image.<ext>", view_func=podcast_image)
+    app.add_url_rule("/rss.xml", view_func=rss)
+    app.add_url_rule("/metrics", view_func=prometheus_metrics)
+    app.add_url_rule("/style.css", view_func=css)
+
+    if config.sighup_reload():
+
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: app_state.reload())
+        except ValueError:
+            pass  # Not the main thread; the catalog is still re-checked every reload interval.
+
+    # Metrics are per process, so they get at most one server however many apps there are.
+    if config.metrics_address() is not None and metrics_server is None:
+        metrics_server = serve_in_background(metrics, *config.metrics_address())
+
+    if preload:
+        app_state.load()
+
+    return app
+
+
+def __getattr__(name):
+    "Create the module's default app, opp.web.app.app, when first asked for, e.g. by a WSGI server."
+
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
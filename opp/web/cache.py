@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # Optional; pages are then precompressed with gzip only
+    brotli = None
+
+"""
+Rendered page and markdown caching for the web interface.
+
+Pages are kept for a single catalog version at a time.  When the datastore reports a new version, the old pages are dropped as a whole rather than invalidated one by one.
+
+Each page is compressed once, when it is rendered, so serving a compressed page costs no more than serving it plain.
+"""
+
+
+def compressors():
+    """Produce the (content coding, compress function) pairs available, most preferred first."""
+
+    # Level 9 / quality 9: within a few percent of the smallest output, at a fraction of brotli's quality 11 time.
+    available = [("gzip", lambda body: gzip.compress(body, compresslevel=9, mtime=0))]
+
+    if brotli is not None:
+        available.insert(0, ("br", lambda body: brotli.compress(body, quality=9)))
+
+    return available
+
+
+class RenderedPage:
+
+    """
+    The rendered bytes of a page, with the validators used for conditional requests.
+
+    variants maps each content coding, including "identity", to the encoded body and its own strong ETag.
+    """
+
+    def __init__(self, body, modified=None):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+        if modified is not None:
+            modified = modified.replace(microsecond=0)
+
+        self.modified = modified
+
+        self.variants = {"identity": (body, self.etag)}
+
+        for coding, compress in compressors():
+            self.variants[coding] = (compress(body), f"{self.etag}-{coding}")
+
+    def negotiate(self, accept_encodings):
+        """
+        Pick the variant to send, given the request's parsed Accept-Encoding.
+
+        Return: (content coding, body, etag)
+        """
+
+        best, best_quality = "identity", 0
+
+        # The client's preference first; among equals, the order of compressors().
+        for coding in self.variants:
+            quality = accept_encodings.quality(coding) if coding != "identity" else 0
+
+            if quality > best_quality:
+                best, best_quality = coding, quality
+
+        body, etag = self.variants[best]
+        return best, body, etag
+
+    def __repr__(self):
+        return f"RenderedPage('{self.etag}', {len(self.body)} bytes)"
+
+
+class RenderCache:
+
+    """Keep RenderedPages for the current catalog version, keyed by page and external host."""
+
+    def __init__(self, max_pages=64):
+        self._max_pages = max_pages
+        self._pages = (None, {})
+
+    def get(self, version, key):
+        """Produce the cached page for the given catalog version, or None."""
+
+        if version is None:
+            return
+
+        current, pages = self._pages
+
+        if current != version:
+            return
+
+        return pages.get(key)
+
+    def has_version(self, version):
+        """Tell whether pages for the given catalog version have been stored."""
+        return version is not None and self._pages[0] == version
+
+    def put(self, version, key, page):
+        """Store a page rendered from the given catalog version."""
+
+        if version is None:
+            return
+
+        current, pages = self._pages
+
+        if current != version:
+            pages = {}
+            self._pages = (version, pages)
+
+        # Keys include the Host header, which clients control; don't let them grow the cache without bound.
+        if len(pages) < self._max_pages:
+            pages[key] = page
+
+    def clear(self):
+        self._pages = (None, {})
+
+
+class MarkdownCache:
+
+    """
+    Memoize a markdown renderer, keeping the most recently used results.
+
+    Entries are keyed by a digest of the text rather than the text itself, so long descriptions aren't held twice.
+    """
+
+    def __init__(self, render, max_entries=4096):
+        self._render = render
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+        with self._lock:
+            html = self._entries.get(key)
+
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+
+        # Render outside the lock; two threads may render the same text once each, which is harmless.
+        html = self._render(text)
+
+        with self._lock:
+            self._entries[key] = html
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return html
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+import flask
+
+import opp.web.app as web
+
+"""
+Static site export.
+
+Write the same pages and files the web app serves into a directory, laid out to match the app's URLs, so that any static file server can take over.  A manifest of input fingerprints is kept alongside, and later exports only rewrite outputs whose inputs changed.
+"""
+
+
+MANIFEST = ".opp-export.json"
+FICLONE = 0x40049409  # Linux reflink ioctl, from <linux/fs.h>
+
+
+def export_static(target_dir, base_url=None, app=None):
+    """
+    Export the podcast into target_dir.
+
+    Required:
+        - target_dir - pathlib.Path, created if missing
+
+    Optional:
+        - base_url - public URL the directory will be served from; defaults to the channel link
+        - app - the Flask app to render with; a new one by default
+
+    Return: list of the output names that were (re)written or removed
+    """
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    if app is None:
+        app = web.create_app()
+
+    config = web.state(app).config
+    data = web.state(app).visit_podcast.podcast_data()
+    channel = data["channel"]
+
+    if base_url is None:
+        base_url = channel["link"]
+
+    previous = read_manifest(target_dir)
+    manifest = {}
+    changed = []
+
+    with app.test_request_context("/", base_url=base_url):
+
+        # A static server can't answer ?page=, so the exported home page lists every episode.
+        for endpoint, template, mimetype, page_size in [("home", "podcast.html", "text/html", None), ("rss", "podcast.xml", "application/rss+xml", config.feed_limit())]:
+            body = web.rendered_response(template, mimetype, page_size=page_size).get_data()
+            name = output_name(endpoint)
+            fingerprint = hashlib.sha256(body).hexdigest()
+
+            if export_needed(target_dir, name, fingerprint, previous):
+                write_bytes(target_dir / name, body)
+                changed.append(name)
+
+            manifest[name] = fingerprint
+
+        sources = {}
+
+        if channel["image"] is not None and os.path.exists(channel["image"]):
+            ext = web.image_extension(channel["image"])
+            name = output_name("podcast_image", ext=ext) if ext is not None else output_name("podcast_image")
+            sources[name] = channel["image"]
+
+        css = config.css_file()
+
+        if css.exists():
+            sources[output_name("css")] = css
+
+        for episode in data["episodes"]:
+            name = output_name("download_episode", guid=episode["guid"], ext=web.download_extension(episode["audio_format"]))
+            sources[name] = episode["path"]
+
+    for name, source in sources.items():
+        fingerprint = file_fingerprint(source)
+
+        if export_needed(target_dir, name, fingerprint, previous):
+            link_file(source, target_dir / name)
+            changed.append(name)
+
+        manifest[name] = fingerprint
+
+    for name in previous:
+
+        if name not in manifest:
+            (target_dir / name).unlink(missing_ok=True)
+            changed.append(name)
+
+    write_bytes(target_dir / MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    return changed
+
+
+def output_name(endpoint, **values):
+    """Produce the file name, relative to the export directory, that stands in for an app URL."""
+
+    path = flask.url_for(endpoint, **values)
+    name = path[len(flask.request.script_root):].lstrip("/")
+
+    return name or "index.html"
+
+
+def read_manifest(target_dir):
+    """Produce the manifest of a previous export, or an empty one."""
+
+    try:
+        with open(target_dir / MANIFEST, "r") as file:
+            return json.load(file)
+
+    except (OSError, ValueError):
+        return {}
+
+
+def export_needed(target_dir, name, fingerprint, previous):
+    return previous.get(name) != fingerprint or not (target_dir / name).exists()
+
+
+def file_fingerprint(path):
+    """Identify the version of a source file without reading it."""
+
+    stat = os.stat(path)
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def write_bytes(path, body):
+    """Replace the file at path with body, so that a server never sees a partial file."""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+
+    with open(temporary, "wb") as file:
+        file.write(body)
+
+    os.replace(temporary, path)
+
+
+def link_file(source, path):
+    """
+    Place source at path without copying the data, where possible.
+
+    Hard links are tried first, then a reflink for filesystems that support one across directories.  A plain copy is the last resort, e.g. when the export lives on another filesystem.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.unlink(missing_ok=True)
+
+    try:
+        os.link(source, temporary)
+
+    except OSError:
+
+        try:
+            reflink(source, temporary)
+
+        except OSError:
+            temporary.unlink(missing_ok=True)
+            shutil.copyfile(source, temporary)
+
+    os.replace(temporary, path)
+
+
+def reflink(source, path):
+    """Clone source to path as a copy-on-write reflink."""
+
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform.")
+
+    with open(source, "rb") as src, open(path, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
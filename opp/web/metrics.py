@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+"""
+Prometheus style metrics.
+
+Every thread counts into its own shard, so recording a request or a timing takes no lock and never contends with other threads.  The shards are only added up when the metrics are scraped.  Servers that start a thread per request would pile up shards, so those of finished threads are folded into a single retired shard from time to time.
+"""
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+RETIRE_AFTER = 64  # Shards kept, at least, before those of finished threads are folded away
+
+
+class Shard:
+
+    """One thread's counters and histograms, keyed by (metric name, labels)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}  # Per-bucket counts, then the sum and the count of observations
+
+
+class Metrics:
+
+    """
+    Collect counters and histograms, and render them in the Prometheus text format.
+
+    Labels are given as tuples of (name, value) pairs.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self._buckets = buckets
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) pairs
+        self._retired = Shard(buckets)  # The totals of finished threads
+        self._retire_at = RETIRE_AFTER
+        self._lock = threading.Lock()  # Only taken when a thread records its first metric, and on scrape
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        """Give a metric its type, counter or histogram, and help text."""
+        self._help[name] = (kind, text)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+
+        if shard is None:
+            shard = Shard(self._buckets)
+            self._local.shard = shard
+
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+
+                if len(self._shards) >= self._retire_at:
+                    self._retire()
+
+        return shard
+
+    def _retire(self):
+        """Fold the shards of finished threads into the retired shard.  Called with the lock held."""
+
+        live = []
+
+        for thread, shard in self._shards:
+
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                add_shard(self._retired.counters, self._retired.histograms, shard)
+
+        self._shards = live
+        # Twice the live shards, so retiring costs O(1) per new thread however many threads are running.
+        self._retire_at = max(RETIRE_AFTER, 2 * len(live))
+
+    def count(self, name, labels=(), value=1):
+        """Add value to a counter."""
+
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """Record an observation, e.g. a duration in seconds, in a histogram."""
+
+        shard = self._shard()
+        key = (name, labels)
+        histogram = shard.histograms.get(key)
+
+        if histogram is None:
+            histogram = [0] * (len(self._buckets) + 2)
+            shard.histograms[key] = histogram
+
+        for i, bound in enumerate(self._buckets):
+
+            if value <= bound:
+                histogram[i] += 1
+                break
+
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @contextmanager
+    def timed(self, operation):
+        """Count the calls to, and the time spent in, a datastore operation."""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.count("opp_datastore_calls_total", (("operation", operation),))
+            self.count("opp_datastore_seconds_total", (("operation", operation),), time.perf_counter() - start)
+
+    def collect(self):
+        """Add up the shards: produce (counters, histograms), keyed like a shard's."""
+
+        counters = {}
+        histograms = {}
+
+        with self._lock:
+            self._retire()
+            add_shard(counters, histograms, self._retired)
+            shards = [shard for thread, shard in self._shards]
+
+        for shard in shards:
+            add_shard(counters, histograms, shard)
+
+        return counters, histograms
+
+    def render(self):
+        """Produce the metrics in the Prometheus text exposition format."""
+
+        counters, histograms = self.collect()
+        lines = []
+        described = set()
+
+        def header(name):
+
+            if name not in described and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name)
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        for (name, labels), values in sorted(histograms.items()):
+            header(name)
+            cumulative = 0
+
+            for bound, count in zip(self._buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+            lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+
+def add_shard(counters, histograms, shard):
+    """Add a shard's counters and histograms into the given ones."""
+
+    # Copies, since the owning thread may be adding keys meanwhile.
+    for key, value in list(shard.counters.items()):
+        counters[key] = counters.get(key, 0) + value
+
+    for key, values in list(shard.histograms.items()):
+        total = histograms.setdefault(key, [0] * len(values))
+
+        for i, value in enumerate(list(values)):
+            total[i] += value
+
+
+def format_labels(labels):
+
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for name, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def serve_in_background(metrics, host, port):
+    """Serve the metrics, at any path, from a separate port on a daemon thread.  Produce the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = metrics.render().encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="opp-metrics", daemon=True).start()
+
+    return server
+
+
+REGISTRY = Metrics()
+
+REGISTRY.describe("opp_requests_total", "counter", "Requests answered, by route, method and status.")
+REGISTRY.describe("opp_request_duration_seconds", "histogram", "Time taken to answer requests, by route.")
+REGISTRY.describe("opp_episode_bytes_total", "counter", "Episode audio bytes sent, by episode guid.")
+REGISTRY.describe("opp_datastore_calls_total", "counter", "Calls to visitor datastore operations.")
+REGISTRY.describe("opp_datastore_seconds_total", "counter", "Time spent in visitor datastore operations.")
+REGISTRY.describe("opp_catalog_reloads_total", "counter", "Catalog changes picked up by the web app.")
+REGISTRY.describe("opp_tenant_loads_total", "counter", "Podcasts loaded when serving several from one process.")
+REGISTRY.describe("opp_tenant_evictions_total", "counter", "Loaded podcasts dropped, by reason: lru or idle.")
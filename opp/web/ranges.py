@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import secrets
+
+"""
+Byte range responses for episode audio.
+
+Everything about the response, down to its length, is worked out from the stored episode length.  The audio file is only opened once the body is actually iterated, so HEAD requests never touch the disk.
+"""
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16  # More than this and the Range header is ignored, rather than seeking all over the file
+
+
+def byte_ranges(request_range, length):
+    """
+    Produce the (start, stop) byte ranges of a parsed Range header that lie within length.
+
+    Return: None if the whole file should be sent instead, otherwise a list of ranges, empty if none are satisfiable
+    """
+
+    if request_range is None or request_range.units != "bytes" or len(request_range.ranges) > MAX_RANGES:
+        return
+
+    ranges = []
+
+    for start, stop in request_range.ranges:
+
+        if start < 0:
+            # Suffix range: the last -start bytes.
+            start = max(length + start, 0)
+            stop = length
+
+        else:
+            stop = length if stop is None else min(stop, length)
+
+        if start < stop:
+            ranges.append((start, stop))
+
+    return ranges
+
+
+def content_range(start, stop, length):
+    return f"bytes {start}-{stop - 1}/{length}"
+
+
+def read_range(file, start, stop, chunk_size=CHUNK_SIZE):
+    """Produce the bytes from start up to stop of an open file, in chunks."""
+
+    file.seek(start)
+    remaining = stop - start
+
+    while remaining > 0:
+        chunk = file.read(min(chunk_size, remaining))
+
+        if not chunk:
+            return
+
+        remaining -= len(chunk)
+        yield chunk
+
+
+def file_range(path, start, stop):
+    """Produce the bytes from start up to stop of the file at path, opening it only once iterated."""
+
+    with open(path, "rb") as file:
+        yield from read_range(file, start, stop)
+
+
+class Multipart:
+
+    """A multipart/byteranges body for several ranges of a file, with its length known up front."""
+
+    def __init__(self, path, ranges, length, mimetype):
+        self.path = path
+        self.ranges = ranges
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+
+        self._headers = [f"\r\n--{self.boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: {content_range(start, stop, length)}\r\n\r\n".encode("ascii") for start, stop in ranges]
+        self._end = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+
+        self.length = sum(len(header) for header in self._headers) + sum(stop - start for start, stop in ranges) + len(self._end)
+
+    def __iter__(self):
+
+        with open(self.path, "rb") as file:
+
+            for header, (start, stop) in zip(self._headers, self.ranges):
+                yield header
+                yield from read_range(file, start, stop)
+
+        yield self._end
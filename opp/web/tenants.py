@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import re
+import signal
+import threading
+import time
+
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import redirect
+from werkzeug.wsgi import get_host
+
+import opp.config
+import opp.web.app as web
+from opp.web.metrics import REGISTRY as metrics
+
+"""
+Serving many podcasts from one process.
+
+Each podcast has its own datastore directory under a common root, and its own Flask app from create_app(), with its own catalog and cached pages and feeds.  Requests are routed to a podcast by the first segment of their path, or by their Host header.  Apps are created when first requested, and only a bounded number are kept, so a process can host many small podcasts in the memory of a few.
+"""
+
+
+# Directory names that may name a podcast: no separators, and nothing hidden or relative.
+TENANT_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+PORT = re.compile(r":\d+$")
+
+
+class Tenants:
+
+    """
+    A WSGI app that hands each request to the app of the podcast it's for, loading apps as they're needed.
+
+    At most max_loaded apps are kept, least recently used dropped first, and any not requested for idle seconds are dropped too.  A dropped podcast is loaded again, from scratch, on its next request.
+    """
+
+    def __init__(self, root, routing="path", max_loaded=16, idle=600.0, make_app=None):
+        """
+        Required:
+            - root - Path of the directory holding a datastore directory for each podcast
+
+        Optional:
+            - routing - "path" to take the podcast name from the first path segment, "host" from the Host header
+            - max_loaded - number of apps kept at once
+            - idle - seconds without requests after which an app is dropped
+            - make_app - produce the app for a podcast's datastore directory; by default create_app() with a TenantConfig
+        """
+
+        self.root = root
+        self.routing = routing
+        self.max_loaded = max_loaded
+        self.idle = idle
+
+        if make_app is None:
+            make_app = lambda directory: web.create_app(opp.config.TenantConfig(directory))
+
+        self._make_app = make_app
+        self._loaded = OrderedDict()  # name -> (app, time last used), least recently used first
+        self._lock = threading.Lock()
+
+    def route(self, environ):
+        """
+        Find which podcast a request is for.  With path routing, the podcast's segment is moved from PATH_INFO to SCRIPT_NAME, so its app builds URLs under it.
+
+        Return: the podcast name, or None if the request doesn't name a podcast
+        """
+
+        if self.routing == "host":
+            name = PORT.sub("", get_host(environ)).lower()
+
+        else:
+            name, slash, rest = environ.get("PATH_INFO", "").lstrip("/").partition("/")
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "").rstrip("/") + "/" + name
+            environ["PATH_INFO"] = slash + rest
+
+        if not TENANT_NAME.fullmatch(name):
+            return
+
+        return name
+
+    def app(self, name):
+        """Produce the app for the named podcast, creating it if need be, or None if there's no such podcast."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            self._drop_idle(now)
+            loaded = self._loaded.get(name)
+
+            if loaded is not None:
+                self._loaded[name] = (loaded[0], now)
+                self._loaded.move_to_end(name)
+                return loaded[0]
+
+        directory = self.root / name
+
+        if not directory.is_dir():
+            return
+
+        # Cheap: the catalog itself is only read on the app's first request.
+        app = self._make_app(directory)
+        metrics.count("opp_tenant_loads_total")
+
+        with self._lock:
+            # Another thread may have created it meanwhile; everyone gets the same one.
+            app = self._loaded.get(name, (app, now))[0]
+            self._loaded[name] = (app, now)
+            self._loaded.move_to_end(name)
+
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+                metrics.count("opp_tenant_evictions_total", (("reason", "lru"),))
+
+        return app
+
+    def _drop_idle(self, now):
+
+        # Least recently used first, so the idle apps are all at the front.
+        while self._loaded:
+            name, (app, used) = next(iter(self._loaded.items()))
+
+            if now - used < self.idle:
+                break
+
+            del self._loaded[name]
+            metrics.count("opp_tenant_evictions_total", (("reason", "idle"),))
+
+    def loaded(self):
+        """Produce the names of the podcasts loaded, least recently used first."""
+
+        with self._lock:
+            return list(self._loaded)
+
+    def reload(self):
+        """Have every loaded podcast's catalog re-read on its next access.  Safe to call from a signal handler."""
+
+        for app, used in list(self._loaded.values()):
+            web.state(app).reload()
+
+    def __call__(self, environ, start_response):
+        name = self.route(environ)
+        app = self.app(name) if name is not None else None
+
+        if app is None:
+            return NotFound()(environ, start_response)
+
+        # A podcast's bare prefix; send it to the home page's own URL.
+        if self.routing == "path" and environ["PATH_INFO"] == "":
+            query = environ.get("QUERY_STRING")
+            return redirect(environ["SCRIPT_NAME"] + "/" + (f"?{query}" if query else ""), 308)(environ, start_response)
+
+        return app(environ, start_response)
+
+
+def create_tenants(config=opp.config):
+    """
+    Produce a Tenants app serving each podcast in config.tenants_dir(), per the OPP_TENANT_* settings.
+
+    Optional:
+        - config - provides the settings, as the opp.config module does
+    """
+
+    root = config.tenants_dir()
+
+    if root is None:
+        raise ValueError("OPP_TENANTS is not set")
+
+    tenants = Tenants(root, config.tenant_routing(), config.tenant_cache_size(), config.tenant_idle(), make_app=lambda directory: web.create_app(config.TenantConfig(directory)))
+
+    if config.sighup_reload():
+
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: tenants.reload())
+        except ValueError:
+            pass  # Not the main thread; catalogs are still re-checked every reload interval.
+
+    return tenants
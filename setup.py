@@ -8,7 +8,7 @@ setup(
     author="Pablo Virgo",
     author_email="mailbox@pablovirgo.com",
     url="https://github.com/ptvirgo/one_page_podcast",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     include_package_data=True,
     package_data={"opp": ["web/templates/*"]},
     entry_points={"console_scripts": ["opp=opp.cli:main"]}
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from benchmarks.suite import compare, run
+
+
+# Fixtures
+
+@pytest.fixture
+def environment(monkeypatch):
+    # The suite points the web app at each generated catalog through the environment.
+    for name in ["OPP", "OPP_BACKEND", "OPP_RELOAD_INTERVAL"]:
+        monkeypatch.setenv(name, "")
+
+
+# Tests
+
+class TestBenchmarks:
+
+    @pytest.mark.parametrize("backend", ["json", "journal", "sqlite"])
+    def test_run(self, environment, backend, tmp_path):
+        results = run(sizes=[10], backend=backend, repeat=1, work_dir=tmp_path)
+
+        assert results["backend"] == backend
+        assert set(results["sizes"]) == {"10"}
+        assert results["sizes"]["10"]["rss_cold"]["runs"] == 1
+
+    def test_compare(self):
+        baseline = {"extract_details": {"a": {"median": 1.0}}, "sizes": {"10": {"b": {"median": 1.0}, "c": {"median": 1.0}}}}
+        results = {"extract_details": {"a": {"median": 1.1}}, "sizes": {"10": {"b": {"median": 2.0}, "c": {"median": 0.5}, "new": {"median": 1.0}}}}
+
+        rows, regressions = compare(results, baseline, tolerance=0.2)
+
+        assert [row[0] for row in rows] == ["a", "10/b", "10/c"]
+        assert regressions == ["10/b"]
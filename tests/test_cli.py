@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import Namespace
+from datetime import date, timedelta
+import json
+import pytest
+
+from opp.administrator import AdminPodcast
+import opp.cli as cli
+import opp.datastore.json_file as jsf
+
+from tests.test_datastore_json import audio_file, initialize_admin_ds
+
+
+# Fixtures
+
+@pytest.fixture
+def admin_podcast(tmp_path):
+    ds = jsf.AdminDS(tmp_path / "podcast")
+    initialize_admin_ds(ds, episodes=3)
+
+    return AdminPodcast(ds)
+
+
+def write_edits(path, *edits):
+    path.write_text("".join((edit if type(edit) is str else json.dumps(edit)) + "\n" for edit in edits))
+    return path
+
+
+def stored(admin_podcast):
+    return [(ep["guid"], ep["title"], ep["duration"], ep["publication_date"]) for ep in admin_podcast.get_episodes()]
+
+
+# Tests
+
+class TestBulkEdit:
+
+    def test_batch(self, admin_podcast, tmp_path, capsys):
+        first, second, third = admin_podcast.get_episodes()
+        edits = write_edits(
+            tmp_path / "edits.jsonl",
+            {"op": "update", "guid": first["guid"], "title": "Renamed", "duration": 90},
+            {"op": "update", "guid": second["guid"], "publication_date": "2001-02-03"},
+            {"op": "delete", "guid": third["guid"]},
+            {"op": "create", "file": str(audio_file(first["audio_format"])), "title": "New", "publication_date": "2002-03-04"},
+        )
+
+        cli.bulk_edit(Namespace(admin_podcast=admin_podcast, file=str(edits)))
+
+        assert "Applied 4 edits." in capsys.readouterr().out
+
+        episodes = {ep["guid"]: ep for ep in admin_podcast.get_episodes()}
+        assert (episodes[first["guid"]]["title"], episodes[first["guid"]]["duration"]) == ("Renamed", 90)
+        assert episodes[second["guid"]]["publication_date"] == "2001-02-03"
+        assert third["guid"] not in episodes
+
+        titles = [ep["title"] for ep in episodes.values()]
+        assert titles.index("New") < titles.index(second["title"])
+
+    def test_malformed_line(self, admin_podcast, tmp_path, capsys):
+        before = stored(admin_podcast)
+        guid = before[0][0]
+        edits = write_edits(tmp_path / "edits.jsonl", {"op": "update", "guid": guid, "title": "Renamed"}, "{\"op\": \"update\",")
+
+        with pytest.raises(SystemExit):
+            cli.bulk_edit(Namespace(admin_podcast=admin_podcast, file=str(edits)))
+
+        assert "line 2:" in capsys.readouterr().err
+        assert stored(admin_podcast) == before
+
+    @pytest.mark.parametrize("field, value", [
+        ("duration", "30"),
+        ("duration", -1),
+        ("duration", True),
+        ("duration", 1.5),
+        ("title", 5),
+        ("description", ["a"]),
+        ("guid", "not-a-guid"),
+        ("publication_date", 20240131),
+    ])
+    def test_wrong_type(self, admin_podcast, tmp_path, capsys, field, value):
+        before = stored(admin_podcast)
+        edit = {"op": "update", "guid": before[0][0], field: value}
+        edits = write_edits(tmp_path / "edits.jsonl", {"op": "update", "guid": before[1][0], "title": "Renamed"}, edit)
+
+        with pytest.raises(SystemExit):
+            cli.bulk_edit(Namespace(admin_podcast=admin_podcast, file=str(edits)))
+
+        error = capsys.readouterr().err
+        assert "line 2:" in error and f"\"{field}\"" in error
+        assert stored(admin_podcast) == before
+
+    def test_uppercase_guid(self, admin_podcast, tmp_path):
+        guid = stored(admin_podcast)[0][0]
+
+        with pytest.raises(ValueError, match="line 1:"):
+            cli.read_edits([json.dumps({"op": "delete", "guid": guid.upper()})])
+
+    def test_wrong_file_type(self, admin_podcast):
+
+        with pytest.raises(ValueError, match="line 1:.*\"file\""):
+            cli.read_edits([json.dumps({"op": "create", "file": 7})])
+
+
+class TestUpdateEpisode:
+
+    def test_publication_date(self, admin_podcast):
+        newest, middle, oldest = admin_podcast.get_episodes()
+        tomorrow = date.today() + timedelta(days=1)
+        args = Namespace(admin_podcast=admin_podcast, guid=oldest["guid"], title=None, description=None, publication_date=str(tomorrow))
+
+        cli.update_episode(args)
+
+        episodes = admin_podcast.get_episodes()
+        assert episodes[0]["guid"] == oldest["guid"]
+        assert episodes[0]["publication_date"] == str(tomorrow)
+        assert episodes[0]["title"] == oldest["title"]
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import opp.datastore.journal as journal
+from opp.podcast import Channel, Episode
+
+from datetime import timedelta
+import pytest
+from pathlib import Path
+
+import tests.factories as factories
+from tests.test_datastore_json import audio_file, check_transaction, check_transaction_failure, episode_batch, initialize_admin_ds
+
+
+# Fixtures
+
+@pytest.fixture
+def admin_ds(tmp_path):
+
+    def make_datastore(initialize=True, episodes=3, compact_threshold=journal.COMPACT_THRESHOLD):
+        ds = journal.AdminDS(Path(tmp_path), compact_threshold=compact_threshold)
+
+        if initialize:
+            initialize_admin_ds(ds, episodes=episodes)
+
+        return ds
+
+    return make_datastore
+
+
+def create_episode(ds):
+    ep = factories.EpisodeFactory()
+
+    with open(audio_file(ep.audio_format), "rb") as file:
+        ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
+
+    return ep
+
+
+def journal_files(tmp_path):
+    return sorted(path.name for path in (tmp_path / journal.JOURNAL_DIR).glob("*-*"))
+
+
+# Tests
+
+class TestVisitorDS:
+    """Test the journal VisitorDS features."""
+
+    def test_get(self, admin_ds, tmp_path):
+        admin = admin_ds()
+        ds = journal.VisitorDS(tmp_path, check_interval=0)
+
+        assert type(ds.get_channel()) is Channel
+        assert ds.get_episodes() == tuple(admin.get_episodes())
+
+        for episode in ds.get_episodes():
+            assert type(episode) is Episode
+            assert ds.get_episode(str(episode.guid)) == episode
+
+    def test_get_episodes_page(self, admin_ds, tmp_path):
+        admin = admin_ds(episodes=4)
+        ds = journal.VisitorDS(tmp_path, check_interval=0)
+        episodes = list(ds.get_episodes())
+        since = episodes[2].publication_date
+
+        assert list(ds.get_episodes(offset=1, limit=2)) == episodes[1:3]
+        assert list(ds.get_episodes(since=since)) == [ep for ep in episodes if ep.publication_date >= since]
+        assert admin.get_episodes(offset=1, limit=2, since=since) == list(ds.get_episodes(offset=1, limit=2, since=since))
+
+    def test_tail(self, admin_ds, tmp_path):
+        admin = admin_ds()
+        ds = journal.VisitorDS(tmp_path, check_interval=0)
+        version = ds.catalog_version()
+        unchanged = ds.get_episodes()[1]
+
+        new = create_episode(admin)
+
+        assert ds.catalog_version() != version
+        assert ds.get_episode(str(new.guid)) == new
+        assert ds.get_episode(str(unchanged.guid)) is unchanged
+
+    def test_partial_record(self, admin_ds, tmp_path):
+        admin_ds()
+        ds = journal.VisitorDS(tmp_path, check_interval=0)
+        version = ds.catalog_version()
+
+        segment = ds._reader.segment
+
+        with open(tmp_path / journal.JOURNAL_DIR / journal.journal_name(segment), "a") as file:
+            file.write('{"op": "delete", "gu')
+
+        assert ds.catalog_version() == version
+        assert len(ds.get_episodes()) == 3
+
+    def test_follows_compaction(self, admin_ds, tmp_path):
+        admin = admin_ds()
+        ds = journal.VisitorDS(tmp_path, check_interval=0)
+        ds.get_episodes()
+
+        admin.compact()
+        new = create_episode(admin)
+
+        assert len(ds.get_episodes()) == 4
+        assert ds.get_episode(str(new.guid)) == new
+
+
+class TestAdminDS:
+    """Test the journal AdminDS features."""
+
+    def test_channel(self, admin_ds):
+        fst = factories.ChannelFactory()
+        snd = factories.ChannelFactory()
+
+        ds = admin_ds(initialize=False)
+
+        ds.initialize_channel(fst.title, fst.link, fst.description, fst.image, fst.author, fst.email, fst.language, fst.category, fst.explicit, fst.keywords)
+        assert dict(ds.get_channel()) == dict(fst)
+
+        ds.update_channel(snd.title, snd.link, snd.description, snd.image, snd.author, snd.email, snd.language, snd.category, snd.explicit, snd.keywords)
+        assert dict(ds.get_channel()) == dict(snd)
+
+    def test_create_episode(self, admin_ds):
+        ds = admin_ds(episodes=0)
+        episodes = sorted([create_episode(ds) for i in range(3)], key=lambda ep: ep.publication_date, reverse=True)
+
+        assert ds.get_episodes() == episodes
+
+    def test_create_episodes(self, admin_ds):
+        ds = admin_ds(episodes=1)
+        prior = ds.get_episodes()
+        episodes = [factories.EpisodeFactory() for i in range(3)]
+
+        ds.create_episodes(episode_batch(episodes))
+
+        assert ds.get_episodes() == sorted(prior + episodes, key=lambda ep: ep.publication_date, reverse=True)
+
+    def test_update_episode(self, admin_ds):
+        ds = admin_ds()
+        old = ds.get_episodes()[1]
+        new = factories.EpisodeFactory()
+
+        for attribute in ["title", "description", "duration", "publication_date"]:
+            value = getattr(new, attribute)
+            ds.update_episode(str(old.guid), **{attribute: value})
+
+            updated = [ep for ep in ds.get_episodes() if ep.guid == old.guid][0]
+            assert getattr(updated, attribute) == value
+
+        with pytest.raises(ValueError):
+            ds.update_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4", title="Missing")
+
+    def test_transaction(self, admin_ds):
+        check_transaction(admin_ds())
+
+    def test_transaction_failure(self, admin_ds):
+        check_transaction_failure(admin_ds())
+
+    def test_delete_episode(self, admin_ds):
+        ds = admin_ds()
+
+        prior = ds.get_episodes()
+        ds.delete_episode(str(prior[1].guid))
+
+        assert ds.get_episodes() == [prior[0], prior[2]]
+        assert not prior[1].path.exists()
+
+        with pytest.raises(ValueError):
+            ds.delete_episode(str(prior[1].guid))
+
+    def test_compaction(self, admin_ds, tmp_path):
+        ds = admin_ds(episodes=2, compact_threshold=1)
+        ds._compaction.join()
+
+        new = create_episode(ds)
+        ds._compaction.join()
+
+        segment = journal.read_segment(tmp_path / journal.JOURNAL_DIR)
+
+        assert segment > 1
+        assert journal_files(tmp_path) == [journal.journal_name(segment), journal.snapshot_name(segment)]
+        assert len(ds.get_episodes()) == 3
+        assert new in ds.get_episodes()
+
+    def test_partial_record(self, admin_ds, tmp_path):
+        """Make sure a record left half-written by a crashed writer doesn't corrupt later appends."""
+
+        ds = admin_ds()
+        visitor_ds = journal.VisitorDS(tmp_path, check_interval=0)
+        segment = visitor_ds._reader.segment
+
+        with open(tmp_path / journal.JOURNAL_DIR / journal.journal_name(segment), "a") as file:
+            file.write('{"op": "delete", "gu')
+
+        new = create_episode(ds)
+        ds.update_episode(str(new.guid), title="Retitled")
+
+        assert len(ds.get_episodes()) == 4
+        assert visitor_ds.get_episode(str(new.guid)).title == "Retitled"
+
+    def test_ordering(self, admin_ds):
+        """Make sure episodes stay newest first through creates and re-dated updates."""
+
+        ds = admin_ds(episodes=6)
+        episodes = ds.get_episodes()
+
+        ds.update_episode(str(episodes[-1].guid), publication_date=episodes[0].publication_date + timedelta(days=1))
+        ds.update_episode(str(episodes[0].guid), publication_date=episodes[-1].publication_date - timedelta(days=1))
+
+        results = ds.get_episodes()
+        dates = [ep.publication_date for ep in results]
+
+        assert dates == sorted(dates, reverse=True)
+        assert results[0].guid == episodes[-1].guid
+        assert results[-1].guid == episodes[0].guid
@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import opp.datastore.files as files
 import opp.datastore.json_file as jsf
+from opp.datastore.catalog import Catalog, ColumnarCatalog
 from opp.podcast import AudioFormat, Channel, Episode
 
+from datetime import date, timedelta
+import hashlib
+import io
+import json
+import os
+import stat
+import threading
 import pytest
 from pathlib import Path
 
@@ -40,6 +49,55 @@ def initialize_admin_ds(ds, episodes=3):
             ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
 
 
+def episode_batch(episodes):
+    """Produce create_episodes arguments for factory episodes, opening each audio file in turn."""
+
+    for ep in episodes:
+
+        with open(audio_file(ep.audio_format), "rb") as file:
+            yield {"input_file_handle": file, "title": ep.title, "description": ep.description, "guid": str(ep.guid), "duration": ep.duration, "publication_date": ep.publication_date, "audio_format": ep.audio_format.value, "length": ep.length}
+
+
+def check_transaction(ds):
+    """Make several changes in a transaction, and check they were all stored."""
+
+    prior = ds.get_episodes()
+    new = factories.EpisodeFactory(publication_date=prior[-1].publication_date - timedelta(days=1))
+
+    with ds.transaction() as batch:
+        batch.create_episodes(episode_batch([new]))
+        batch.update_episode(str(new.guid), title="Renamed")
+        batch.update_episode(str(prior[2].guid), publication_date=prior[0].publication_date + timedelta(days=1))
+        batch.delete_episode(str(prior[1].guid))
+
+        assert ds.get_episodes() == prior
+
+    episodes = {str(ep.guid): ep for ep in ds.get_episodes()}
+
+    assert set(episodes) == {str(new.guid), str(prior[0].guid), str(prior[2].guid)}
+    assert episodes[str(new.guid)].title == "Renamed"
+    assert ds.get_episodes()[0].guid == prior[2].guid
+    assert not prior[1].path.exists()
+
+
+def check_transaction_failure(ds):
+    """Make a transaction fail part way, and check nothing was stored."""
+
+    prior = ds.get_episodes()
+    new = factories.EpisodeFactory()
+
+    with pytest.raises(ValueError):
+
+        with ds.transaction() as batch:
+            batch.create_episodes(episode_batch([new]))
+            batch.delete_episode(str(prior[0].guid))
+            batch.update_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4", title="Missing")
+
+    assert ds.get_episodes() == prior
+    assert prior[0].path.exists()
+    assert not ds.audio_file_path(str(new.guid), new.audio_format.value).exists()
+
+
 @pytest.fixture
 def admin_ds(tmp_path):
 
@@ -83,11 +141,118 @@ class TestVisitorDS:
         for ep in episodes:
             assert type(ep) is Episode
 
+    def test_get_episodes_page(self, visitor_ds):
+        episodes = list(visitor_ds.get_episodes())
+        since = episodes[1].publication_date
+
+        assert list(visitor_ds.get_episodes(offset=1, limit=1)) == episodes[1:2]
+        assert list(visitor_ds.get_episodes(offset=5)) == []
+        assert list(visitor_ds.get_episodes(since=since)) == [ep for ep in episodes if ep.publication_date >= since]
+        assert list(visitor_ds.get_episodes(offset=1, since=since)) == [ep for ep in episodes if ep.publication_date >= since][1:]
+
     def test_get_episode(self, visitor_ds):
 
         for episode in visitor_ds.get_episodes():
             assert visitor_ds.get_episode(str(episode.guid)) == episode
 
+    def test_get_missing_episode(self, visitor_ds):
+        assert visitor_ds.get_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4") is None
+
+    def test_get_episode_canonical_guid(self, visitor_ds):
+        guid = str(visitor_ds.get_episodes()[0].guid)
+
+        assert visitor_ds.get_episode(guid.upper()) is None
+        assert visitor_ds.get_episode("not-a-guid") is None
+
+    def test_columns(self, tmp_path):
+        """Make sure every stored field survives the columnar catalog."""
+
+        admin = jsf.AdminDS(tmp_path)
+        initialize_admin_ds(admin, episodes=3)
+        ds = jsf.VisitorDS(tmp_path)
+
+        for stored, served in zip(admin.get_episodes(), ds.get_episodes()):
+            assert dict(served) == dict(stored)
+
+    def test_reload_on_change(self, tmp_path):
+        """Make sure new episodes are picked up, while existing snapshots stay unchanged."""
+
+        admin = jsf.AdminDS(tmp_path)
+        initialize_admin_ds(admin, episodes=2)
+
+        ds = jsf.VisitorDS(tmp_path, check_interval=0)
+        before = ds.get_episodes()
+
+        ep = factories.EpisodeFactory()
+
+        with open(audio_file(ep.audio_format), "rb") as file:
+            admin.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
+
+        assert len(before) == 2
+        assert len(ds.get_episodes()) == 3
+        assert ds.get_episode(str(ep.guid)) == ep
+
+    def test_forced_reload(self, tmp_path):
+        """Make sure reload() takes effect before the check interval elapses."""
+
+        admin = jsf.AdminDS(tmp_path)
+        initialize_admin_ds(admin, episodes=2)
+
+        ds = jsf.VisitorDS(tmp_path, check_interval=3600)
+        guid = str(ds.get_episodes()[0].guid)
+
+        admin.delete_episode(guid)
+        assert ds.get_episode(guid) is not None
+
+        ds.reload()
+        assert ds.get_episode(guid) is None
+
+
+class TestColumnarCatalog:
+
+    @staticmethod
+    def episodes_data(size):
+        episodes = []
+
+        for i in range(size):
+            ep = factories.EpisodeFactory()
+            episodes.append({"title": ep.title, "description": ep.description, "guid": str(ep.guid), "duration": ep.duration, "publication_date": ep.publication_date.isoformat(), "audio_format": ep.audio_format.value, "path": f"/episodes/{ep.guid}.mp3", "length": ep.length})
+
+        return episodes
+
+    def test_same_as_catalog(self):
+        episodes_data = self.episodes_data(50)
+        catalog = Catalog(None, [jsf.data_to_episode(ep) for ep in episodes_data])
+        columnar = ColumnarCatalog(None, episodes_data)
+        since = catalog.episodes[20].publication_date
+
+        assert len(columnar) == 50
+        assert [dict(ep) for ep in columnar.select()] == [dict(ep) for ep in catalog.select()]
+        assert [dict(ep) for ep in columnar.select(5, 10, since)] == [dict(ep) for ep in catalog.select(5, 10, since)]
+
+        for ep in episodes_data:
+            assert dict(columnar.get_episode(ep["guid"])) == dict(catalog.get_episode(ep["guid"]))
+
+    def test_smaller(self):
+        import tracemalloc
+
+        episodes_data = self.episodes_data(2000)
+
+        def allocated(build):
+            tracemalloc.start()
+
+            try:
+                catalog = build()
+                return tracemalloc.get_traced_memory()[0], catalog
+            finally:
+                tracemalloc.stop()
+
+        # Only the memory the catalog holds on to: the text is shared by both.
+        objects, catalog = allocated(lambda: Catalog(None, [jsf.data_to_episode(ep) for ep in episodes_data]))
+        columns, columnar = allocated(lambda: ColumnarCatalog(None, episodes_data))
+
+        assert columns * 4 < objects
+
 
 class TestAdminDS:
     """Test the AdminDS features."""
@@ -174,6 +339,90 @@ class TestAdminDS:
             assert audio_file_path.exists()
             assert not audio_file_path.is_dir()
 
+    def test_create_episodes(self, admin_ds, monkeypatch):
+        """Make sure a batch of episodes is added with a single write of the catalog."""
+        ds = admin_ds(initialize=True, episodes=1)
+        prior = ds.get_episodes()
+        episodes = [factories.EpisodeFactory() for i in range(4)]
+
+        writes = []
+        write_json = files.write_json
+        monkeypatch.setattr(files, "write_json", lambda path, data: writes.append(path) or write_json(path, data))
+
+        ds.create_episodes(episode_batch(episodes))
+
+        assert len(writes) == 1
+        assert ds.get_episodes() == sorted(prior + episodes, key=lambda ep: ep.publication_date, reverse=True)
+
+    def test_create_episodes_failure(self, admin_ds, tmp_path):
+        """Make sure a failed copy leaves neither catalog entries nor audio behind."""
+        ds = admin_ds(initialize=True, episodes=0)
+
+        def batch():
+            yield from episode_batch([factories.EpisodeFactory()])
+            raise OSError("Read failed")
+
+        with pytest.raises(OSError):
+            ds.create_episodes(batch())
+
+        assert ds.get_episodes() == []
+        assert list((tmp_path / jsf.EPISODE_DIR).iterdir()) == []
+
+    def test_create_episode_stored(self, admin_ds):
+        """Make sure the stored copy is complete and its length is recorded."""
+        ds = admin_ds(initialize=True, episodes=0)
+        ep = factories.EpisodeFactory()
+        source = audio_file(ep.audio_format)
+
+        with open(source, "rb") as file:
+            ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, 0)
+
+        result = ds.get_episodes()[0]
+
+        assert result.path.read_bytes() == source.read_bytes()
+        assert result.length == source.stat().st_size
+        assert list(result.path.parent.glob(".*")) == []
+
+    def test_concurrent_create(self, admin_ds, tmp_path):
+        """Make sure concurrent writers don't lose each other's episodes."""
+        admin_ds(initialize=True, episodes=0)
+        new = [factories.EpisodeFactory() for i in range(8)]
+
+        def create(ep):
+            ds = jsf.AdminDS(tmp_path)
+
+            with open(audio_file(ep.audio_format), "rb") as file:
+                ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
+
+        threads = [threading.Thread(target=create, args=(ep,)) for ep in new]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        stored = {ep.guid for ep in jsf.AdminDS(tmp_path).get_episodes()}
+
+        assert stored == {ep.guid for ep in new}
+        assert list(tmp_path.glob(".opp.json.*")) == []
+
+    def test_catalog_mode(self, admin_ds, tmp_path):
+        """Make sure rewriting the catalog keeps it readable, and keeps any permissions set on it."""
+
+        umask = os.umask(0o022)
+
+        try:
+            ds = admin_ds()
+            assert stat.S_IMODE((tmp_path / jsf.OPP_JSON).stat().st_mode) == 0o644
+
+            os.chmod(tmp_path / jsf.OPP_JSON, 0o664)
+            ds.delete_episode(str(ds.get_episodes()[0].guid))
+            assert stat.S_IMODE((tmp_path / jsf.OPP_JSON).stat().st_mode) == 0o664
+
+        finally:
+            os.umask(umask)
+
     def test_update_episode(self, admin_ds):
         """Make sure we can update an episode."""
 
@@ -185,7 +434,7 @@ class TestAdminDS:
 
         new = factories.EpisodeFactory()
 
-        for attribute in ["title", "description", "duration", "publication_date"]:
+        for attribute in ["title", "description", "duration"]:
             value = getattr(new, attribute)
             ds.update_episode(str(old.guid), **{attribute: value})
             updated = ds.get_episodes()[1]
@@ -195,6 +444,57 @@ class TestAdminDS:
         control_post = ds.get_episodes()[0]
         assert control_post == control_prior
 
+        with pytest.raises(ValueError):
+            ds.update_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4", title="Missing")
+
+    def test_transaction(self, admin_ds, monkeypatch):
+        ds = admin_ds()
+        writes = []
+        write_json = files.write_json
+        monkeypatch.setattr(files, "write_json", lambda *args: writes.append(1) or write_json(*args))
+
+        check_transaction(ds)
+        assert len(writes) == 1
+
+    def test_transaction_failure(self, admin_ds):
+        check_transaction_failure(admin_ds())
+
+    def test_update_publication_date(self, admin_ds):
+        """Make sure an episode moves to its place when its date changes."""
+
+        ds = admin_ds()
+        oldest = ds.get_episodes()[-1]
+
+        ds.update_episode(str(oldest.guid), publication_date=ds.get_episodes()[0].publication_date + timedelta(days=1))
+        episodes = ds.get_episodes()
+
+        assert episodes[0].guid == oldest.guid
+        assert [ep.publication_date for ep in episodes] == sorted((ep.publication_date for ep in episodes), reverse=True)
+
+    def test_same_day_order(self, admin_ds):
+        """Make sure episodes published the same day stay in the order they were added."""
+
+        ds = admin_ds(episodes=0)
+        new = factories.EpisodeFactory.build_batch(4, publication_date=date(2020, 1, 1))
+        ds.create_episodes(episode_batch(new[:2]))
+        ds.create_episodes(episode_batch(new[2:]))
+
+        assert [ep.guid for ep in ds.get_episodes()] == [ep.guid for ep in new]
+
+    def test_unordered_catalog(self, admin_ds, tmp_path):
+        """Make sure a catalog stored out of order, as updates used to leave it, is put back in order."""
+
+        ds = admin_ds()
+        podcast_data = json.loads((tmp_path / jsf.OPP_JSON).read_text())
+        podcast_data["episodes"].reverse()
+        files.write_json(tmp_path / jsf.OPP_JSON, podcast_data)
+
+        episodes = ds.get_episodes()
+        assert [ep.publication_date for ep in episodes] == sorted((ep.publication_date for ep in episodes), reverse=True)
+
+        ds.delete_episode(str(episodes[1].guid))
+        assert ds.get_episodes() == [episodes[0], episodes[2]]
+
     def test_delete_episode(self, admin_ds):
         """Make sure we can delete an episode."""
 
@@ -209,3 +509,42 @@ class TestAdminDS:
 
         assert post_episodes[0] == prior_episodes[0]
         assert post_episodes[-1] == prior_episodes[-1]
+
+
+class TestFiles:
+    """Test the shared file helpers."""
+
+    def test_store_stream(self, tmp_path):
+        data = bytes(range(256)) * 40
+        path = tmp_path / "stored"
+
+        sha256, length = files.store_stream(io.BytesIO(data), path, chunk_size=1000)
+
+        assert path.read_bytes() == data
+        assert length == len(data)
+        assert sha256 == hashlib.sha256(data).hexdigest()
+
+    def test_store_stream_mode(self, tmp_path):
+        """Make sure stored files get ordinary permissions, not tempfile's private ones."""
+
+        umask = os.umask(0o022)
+
+        try:
+            files.store_stream(io.BytesIO(b"audio"), tmp_path / "stored")
+        finally:
+            os.umask(umask)
+
+        assert stat.S_IMODE((tmp_path / "stored").stat().st_mode) == 0o644
+
+    def test_store_stream_failure(self, tmp_path):
+
+        class Broken(io.BytesIO):
+            def readinto(self, buffer):
+                raise OSError("read failed")
+
+        path = tmp_path / "stored"
+
+        with pytest.raises(OSError):
+            files.store_stream(Broken(), path)
+
+        assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import opp.datastore.json_file as jsf
+import opp.datastore.sqlite as sqlite
+from opp.podcast import Channel, Episode
+
+import pytest
+from pathlib import Path
+
+import tests.factories as factories
+from tests.test_datastore_json import audio_file, check_transaction, check_transaction_failure, episode_batch, initialize_admin_ds
+
+
+# Fixtures
+
+@pytest.fixture
+def admin_ds(tmp_path):
+
+    def make_datastore(initialize=True, episodes=3):
+        ds = sqlite.AdminDS(Path(tmp_path))
+
+        if initialize:
+            initialize_admin_ds(ds, episodes=episodes)
+
+        return ds
+
+    return make_datastore
+
+
+@pytest.fixture
+def visitor_ds(admin_ds, tmp_path):
+    admin_ds()
+    return sqlite.VisitorDS(Path(tmp_path), check_interval=0)
+
+
+# Tests
+
+class TestVisitorDS:
+    """Test the SQLite VisitorDS features."""
+
+    def test_get_channel(self, visitor_ds):
+        assert type(visitor_ds.get_channel()) is Channel
+
+    def test_get_episodes(self, visitor_ds):
+        episodes = visitor_ds.get_episodes()
+        assert len(episodes) == 3
+
+        for ep in episodes:
+            assert type(ep) is Episode
+
+        dates = [ep.publication_date for ep in episodes]
+        assert dates == sorted(dates, reverse=True)
+
+    def test_get_episodes_page(self, visitor_ds):
+        episodes = list(visitor_ds.get_episodes())
+        since = episodes[1].publication_date
+
+        assert list(visitor_ds.get_episodes(offset=1, limit=1)) == episodes[1:2]
+        assert list(visitor_ds.get_episodes(offset=5)) == []
+        assert list(visitor_ds.get_episodes(since=since)) == [ep for ep in episodes if ep.publication_date >= since]
+        assert list(visitor_ds.get_episodes(offset=1, since=since)) == [ep for ep in episodes if ep.publication_date >= since][1:]
+
+    def test_get_episode(self, visitor_ds):
+
+        for episode in visitor_ds.get_episodes():
+            assert visitor_ds.get_episode(str(episode.guid)) == episode
+
+        assert visitor_ds.get_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4") is None
+
+    def test_catalog_version(self, visitor_ds, tmp_path):
+        version = visitor_ds.catalog_version()
+
+        sqlite.AdminDS(tmp_path).delete_episode(str(visitor_ds.get_episodes()[0].guid))
+
+        assert visitor_ds.catalog_version() != version
+        assert len(visitor_ds.get_episodes()) == 2
+
+
+class TestAdminDS:
+    """Test the SQLite AdminDS features."""
+
+    def test_channel(self, admin_ds):
+        fst = factories.ChannelFactory()
+        snd = factories.ChannelFactory(keywords=["one", "two"], explicit=True)
+
+        ds = admin_ds(initialize=False)
+
+        ds.initialize_channel(fst.title, fst.link, fst.description, fst.image, fst.author, fst.email, fst.language, fst.category, fst.explicit, fst.keywords)
+        assert dict(ds.get_channel()) == dict(fst)
+
+        ds.update_channel(snd.title, snd.link, snd.description, snd.image, snd.author, snd.email, snd.language, snd.category, snd.explicit, snd.keywords)
+        assert dict(ds.get_channel()) == dict(snd)
+
+    def test_create_episode(self, admin_ds):
+        ds = admin_ds(episodes=0)
+        episodes = []
+
+        for i in range(3):
+            ep = factories.EpisodeFactory()
+            episodes.append(ep)
+
+            with open(audio_file(ep.audio_format), "rb") as file:
+                ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
+
+        episodes.sort(key=lambda ep: ep.publication_date, reverse=True)
+        results = ds.get_episodes()
+
+        for i in range(3):
+            assert results[i] == episodes[i]
+            assert results[i].path.read_bytes() == audio_file(episodes[i].audio_format).read_bytes()
+
+    def test_create_episodes(self, admin_ds):
+        ds = admin_ds(episodes=1)
+        prior = ds.get_episodes()
+        episodes = [factories.EpisodeFactory() for i in range(3)]
+
+        ds.create_episodes(episode_batch(episodes))
+
+        assert ds.get_episodes() == sorted(prior + episodes, key=lambda ep: ep.publication_date, reverse=True)
+
+    def test_update_episode(self, admin_ds):
+        ds = admin_ds()
+        old = ds.get_episodes()[1]
+        new = factories.EpisodeFactory()
+
+        for attribute in ["title", "description", "duration", "publication_date"]:
+            value = getattr(new, attribute)
+            ds.update_episode(str(old.guid), **{attribute: value})
+
+            updated = [ep for ep in ds.get_episodes() if ep.guid == old.guid][0]
+            assert getattr(updated, attribute) == value
+
+        with pytest.raises(ValueError):
+            ds.update_episode("eb8766d0-ea67-4de4-bdb5-ef279fe7efb4", title="Missing")
+
+    def test_transaction(self, admin_ds):
+        check_transaction(admin_ds())
+
+    def test_transaction_failure(self, admin_ds):
+        check_transaction_failure(admin_ds())
+
+    def test_delete_episode(self, admin_ds):
+        ds = admin_ds()
+
+        prior = ds.get_episodes()
+        ds.delete_episode(str(prior[1].guid))
+
+        assert ds.get_episodes() == [prior[0], prior[2]]
+        assert not prior[1].path.exists()
+
+
+class TestMigration:
+
+    def test_migrate_json(self, tmp_path):
+        json_ds = jsf.AdminDS(tmp_path)
+        initialize_admin_ds(json_ds, episodes=4)
+
+        assert sqlite.migrate_json(tmp_path) == 4
+
+        ds = sqlite.AdminDS(tmp_path)
+
+        assert dict(ds.get_channel()) == dict(json_ds.get_channel())
+        assert ds.get_episodes() == json_ds.get_episodes()
+
+    def test_rerun_migration(self, tmp_path):
+        """Make sure re-running the migration doesn't undo changes made through SQLite."""
+
+        initialize_admin_ds(jsf.AdminDS(tmp_path), episodes=2)
+        sqlite.migrate_json(tmp_path)
+
+        ds = sqlite.AdminDS(tmp_path)
+        channel = ds.get_channel()
+        ds.update_channel("Renamed", channel.link, channel.description, channel.image, channel.author, channel.email, channel.language, channel.category, channel.explicit, channel.keywords)
+
+        assert sqlite.migrate_json(tmp_path) == 0
+        assert ds.get_channel().title == "Renamed"
+
+
+class TestUninitialized:
+
+    def test_missing_database(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            sqlite.VisitorDS(tmp_path)
+
+        assert not (tmp_path / sqlite.DATABASE).exists()
+
+    def test_missing_channel(self, tmp_path):
+        sqlite.AdminDS(tmp_path)
+        ds = sqlite.VisitorDS(tmp_path)
+
+        with pytest.raises(LookupError, match="no channel"):
+            ds.get_channel()
@@ -25,8 +25,9 @@ class VisitorTestStore(visitor.PodcastDatastore):
     def get_channel(self):
         return self.channel
 
-    def get_episodes(self):
-        return self.episodes
+    def get_episodes(self, offset=0, limit=None, since=None):
+        episodes = [ep for ep in self.episodes if since is None or ep.publication_date >= since]
+        return episodes[offset:None if limit is None else offset + limit]
 
     def get_episode(self, guid):
         for ep in self.episodes:
@@ -136,9 +137,10 @@ class AdministratorTestStore(administrator.PodcastDatastore):
         self._episodes.append(episode)
         self._episodes.sort(key=lambda x: x.publication_date)
 
-    def get_episodes(self):
+    def get_episodes(self, offset=0, limit=None, since=None):
         """Produce an iterable of podcast.Episodes."""
-        return self._episodes
+        episodes = [ep for ep in self._episodes if since is None or ep.publication_date >= since]
+        return episodes[offset:None if limit is None else offset + limit]
 
     def update_episode(self, guid, title=None, description=None, duration=None, publication_date=None):
         """Update an existing episode."""
@@ -292,6 +294,22 @@ class TestAdministrator:
 
         assert result == expect
 
+    def test_ingest_episode(self, admin_store, monkeypatch):
+        datastore = admin_store(episode_count=0)
+        admin_interface = administrator.AdminPodcast(datastore)
+        source = data_dir / "speech.ogg"
+        received = []
+
+        def create_episode(file_handle, title, description, guid, duration, publication_date, audio_format, length):
+            received.append((file_handle.read(), title, description, duration, audio_format, length))
+
+        monkeypatch.setattr(datastore, "create_episode", create_episode)
+
+        with open(source, "rb") as file:
+            admin_interface.ingest_episode(file, description="Given")
+
+        assert received == [(source.read_bytes(), "Speech Test at q3", "Given", 11, AudioFormat.OggVorbis.value, 95837)]
+
     def test_update_episode(self, admin_store):
         datastore = admin_store(episode_count=3)
         admin_interface = administrator.AdminPodcast(datastore)
@@ -311,6 +329,19 @@ class TestAdministrator:
         admin_interface.update_episode(prev.guid, publication_date=new.publication_date)
         assert prev.publication_date == new.publication_date
 
+    def test_transaction(self, admin_store):
+        datastore = admin_store(episode_count=3)
+        admin_interface = administrator.AdminPodcast(datastore)
+        first, second = datastore._episodes[:2]
+
+        # The datastore's fallback transaction makes each change as it's called.
+        with admin_interface.transaction() as batch:
+            batch.update_episode(first.guid, title="Retitled")
+            batch.delete_episode(second.guid)
+
+        assert first.title == "Retitled"
+        assert second not in datastore._episodes
+
     def test_delete_episode(self, admin_store):
         datastore = admin_store(episode_count=3)
         admin_interface = administrator.AdminPodcast(datastore)
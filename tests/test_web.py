@@ -0,0 +1,861 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import opp.config as config
+import opp.datastore.json_file as jsf
+
+import tests.factories as factories
+from tests.test_datastore_json import audio_file, initialize_admin_ds
+
+
+# Fixtures
+
+@pytest.fixture
+def admin_ds(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPP", str(tmp_path))
+    monkeypatch.setenv("OPP_RELOAD_INTERVAL", "0")
+
+    ds = jsf.AdminDS(tmp_path)
+    initialize_admin_ds(ds, episodes=3)
+
+    return ds
+
+
+@pytest.fixture
+def app(admin_ds):
+    import opp.web.app as web
+
+    app = web.create_app()
+    app.config["TESTING"] = True
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_episode(ds):
+    ep = factories.EpisodeFactory()
+
+    with open(audio_file(ep.audio_format), "rb") as file:
+        ds.create_episode(file, ep.title, ep.description, str(ep.guid), ep.duration, ep.publication_date, ep.audio_format.value, ep.length)
+
+    return ep
+
+
+# Tests
+
+class TestRenderedPages:
+
+    @pytest.mark.parametrize("url", ["/", "/rss.xml"])
+    def test_validators(self, client, url):
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+
+        assert client.get(url).data == response.data
+
+    @pytest.mark.parametrize("url", ["/", "/rss.xml"])
+    def test_not_modified(self, client, url):
+        response = client.get(url)
+
+        etag = client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+        assert etag.status_code == 304
+        assert etag.data == b""
+
+        modified = client.get(url, headers={"If-Modified-Since": response.headers["Last-Modified"]})
+        assert modified.status_code == 304
+
+    def test_new_episode(self, client, admin_ds):
+        response = client.get("/rss.xml")
+
+        ep = add_episode(admin_ds)
+
+        updated = client.get("/rss.xml", headers={"If-None-Match": response.headers["ETag"]})
+        assert updated.status_code == 200
+        assert updated.headers["ETag"] != response.headers["ETag"]
+        assert str(ep.guid).encode() in updated.data
+
+    def test_per_host(self, client):
+        one = client.get("/rss.xml", base_url="http://one.example.com")
+        two = client.get("/rss.xml", base_url="http://two.example.com")
+
+        assert b"one.example.com" in one.data
+        assert b"two.example.com" in two.data
+        assert one.headers["ETag"] != two.headers["ETag"]
+
+
+class TestExport:
+
+    def test_export(self, client, admin_ds, tmp_path):
+        import opp.web.export as export
+
+        site = tmp_path / "site"
+        written = export.export_static(site, base_url="http://podcast.example.com/")
+
+        assert "index.html" in written
+        assert "rss.xml" in written
+        assert (site / "index.html").read_bytes() == client.get("/", base_url="http://podcast.example.com/").data
+        assert (site / "rss.xml").read_bytes() == client.get("/rss.xml", base_url="http://podcast.example.com/").data
+
+        for ep in admin_ds.get_episodes():
+            exported = site / "episode" / ep.path.name
+            assert exported.stat().st_ino == ep.path.stat().st_ino
+
+    def test_incremental(self, client, admin_ds, tmp_path):
+        import opp.web.export as export
+
+        site = tmp_path / "site"
+        export.export_static(site, base_url="http://podcast.example.com/")
+
+        assert export.export_static(site, base_url="http://podcast.example.com/") == []
+
+        new = add_episode(admin_ds)
+        written = export.export_static(site, base_url="http://podcast.example.com/")
+
+        assert sorted(written) == sorted(["index.html", "rss.xml", f"episode/{admin_ds.audio_file_path(str(new.guid), new.audio_format).name}"])
+
+        admin_ds.delete_episode(str(new.guid))
+        written = export.export_static(site, base_url="http://podcast.example.com/")
+
+        assert len(written) == 3
+        assert not any((site / "episode").glob(f"{new.guid}.*"))
+
+    def test_image_extension(self, client, admin_ds, tmp_path):
+        import opp.web.export as export
+
+        cover = tmp_path / "cover.JPG"
+        cover.write_bytes(b"not really a jpeg")
+
+        channel = admin_ds.get_channel()
+        admin_ds.update_channel(channel.title, channel.link, channel.description, str(cover), channel.author, channel.email, channel.language, channel.category, channel.explicit, channel.keywords)
+
+        site = tmp_path / "site"
+        written = export.export_static(site, base_url="http://podcast.example.com/")
+
+        assert "image.jpg" in written
+        assert (site / "image.jpg").read_bytes() == cover.read_bytes()
+        assert b"http://podcast.example.com/image.jpg" in (site / "rss.xml").read_bytes()
+        assert b'src="/image.jpg"' in (site / "index.html").read_bytes()
+
+        assert client.get("/image.jpg").data == cover.read_bytes()
+
+
+class TestMarkdown:
+
+    def test_memoized(self):
+        from opp.web.cache import MarkdownCache
+
+        calls = []
+        cache = MarkdownCache(lambda text: calls.append(text) or f"<p>{text}</p>", max_entries=2)
+
+        assert cache("one") == "<p>one</p>"
+        assert cache("one") == "<p>one</p>"
+        assert calls == ["one"]
+
+        cache("two")
+        cache("three")
+
+        assert len(cache) == 2
+
+        cache("one")
+        assert calls == ["one", "two", "three", "one"]
+
+    def test_catalog_change(self, app, client, admin_ds, monkeypatch):
+        import opp.web.app as web
+
+        client.get("/")
+        rendered = []
+        monkeypatch.setattr(web.state(app).rendered_markdown, "_render", lambda text: rendered.append(text) or text)
+
+        ep = add_episode(admin_ds)
+        client.get("/rss.xml")
+
+        assert rendered == [ep.description]
+
+        client.get("/")
+        assert rendered == [ep.description]
+
+
+class TestPodcastView:
+
+    def test_shared_between_pages(self, app, client, monkeypatch):
+        import opp.web.app as web
+
+        # The home page and the feed show the same episodes when the page size matches the feed limit.
+        monkeypatch.setenv("OPP_PAGE_SIZE", "20")
+        monkeypatch.setenv("OPP_FEED_LIMIT", "20")
+        client.get("/")
+
+        def fail(**selection):
+            raise AssertionError("podcast data rebuilt")
+
+        monkeypatch.setattr(web.state(app).visit_podcast, "podcast_data", fail)
+
+        assert client.get("/rss.xml").status_code == 200
+
+    def test_read_only(self, app):
+        import opp.web.app as web
+
+        with app.test_request_context("/"):
+            view = web.podcast_view()
+
+            assert web.podcast_view() is view
+            assert view.episodes[0]["url"].startswith("http://localhost/episode/")
+
+            with pytest.raises(TypeError):
+                view.episodes[0]["title"] = "Changed"
+
+
+class TestPagination:
+
+    def test_home_pages(self, client, admin_ds, monkeypatch):
+        monkeypatch.setenv("OPP_PAGE_SIZE", "2")
+        titles = [ep.title for ep in admin_ds.get_episodes()]
+
+        first = client.get("/").get_data(as_text=True)
+        second = client.get("/?page=2").get_data(as_text=True)
+
+        assert titles[0] in first and titles[2] not in first
+        assert 'href="/?page=2"' in first
+        assert titles[2] in second and titles[0] not in second
+        assert 'href="/"' in second and "?page=3" not in second
+
+        assert client.get("/?page=3").status_code == 404
+        assert client.get("/?page=0").status_code == 404
+
+    @pytest.mark.parametrize("size", ["0", "-1"])
+    def test_bad_page_size(self, monkeypatch, size):
+        monkeypatch.setenv("OPP_PAGE_SIZE", size)
+
+        with pytest.raises(ValueError):
+            config.page_size()
+
+    def test_feed_limit(self, client, admin_ds, monkeypatch):
+        titles = [ep.title for ep in admin_ds.get_episodes()]
+
+        assert all(title in client.get("/rss.xml").get_data(as_text=True) for title in titles)
+
+        monkeypatch.setenv("OPP_FEED_LIMIT", "1")
+        feed = client.get("/rss.xml").get_data(as_text=True)
+
+        assert titles[0] in feed
+        assert titles[1] not in feed and titles[2] not in feed
+
+
+class TestSendfile:
+
+    def test_python_by_default(self, client, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+        response = client.get(f"/episode/{episode.guid}.mp3")
+
+        assert response.get_data() == episode.path.read_bytes()
+        assert "X-Accel-Redirect" not in response.headers
+        assert "X-Sendfile" not in response.headers
+
+    def test_x_accel_redirect(self, client, admin_ds, monkeypatch):
+        monkeypatch.setenv("OPP_SENDFILE", "x-accel-redirect")
+        monkeypatch.setenv("OPP_SENDFILE_PREFIX", "/internal/audio/")
+        episode = admin_ds.get_episodes()[0]
+
+        response = client.get(f"/episode/{episode.guid}.mp3")
+
+        assert response.status_code == 200
+        assert response.get_data() == b""
+        assert response.headers["X-Accel-Redirect"] == f"/internal/audio/{episode.path.name}"
+        assert response.mimetype.startswith("audio/")
+
+    def test_x_sendfile(self, client, admin_ds, monkeypatch):
+        monkeypatch.setenv("OPP_SENDFILE", "x-sendfile")
+        episode = admin_ds.get_episodes()[0]
+
+        response = client.get(f"/episode/{episode.guid}.mp3")
+
+        assert response.get_data() == b""
+        assert response.headers["X-Sendfile"] == str(episode.path)
+
+    def test_missing_episode(self, client, monkeypatch):
+        monkeypatch.setenv("OPP_SENDFILE", "x-sendfile")
+
+        assert client.get("/episode/eb8766d0-ea67-4de4-bdb5-ef279fe7efb4.mp3").status_code == 404
+
+
+class TestEpisodeAudio:
+
+    @pytest.fixture
+    def episode(self, admin_ds):
+        return admin_ds.get_episodes()[0]
+
+    def url(self, episode):
+        return f"/episode/{episode.guid}.mp3"
+
+    def test_headers(self, client, episode):
+        response = client.get(self.url(episode))
+
+        assert response.get_data() == episode.path.read_bytes()
+        assert response.headers["ETag"] == f'"{episode.guid}"'
+        assert "immutable" in response.headers["Cache-Control"]
+        assert response.headers["Accept-Ranges"] == "bytes"
+
+    def test_not_modified(self, client, episode):
+        response = client.get(self.url(episode), headers={"If-None-Match": f'"{episode.guid}"'})
+
+        assert response.status_code == 304
+        assert response.get_data() == b""
+
+    def test_head_from_metadata(self, app, client, episode, monkeypatch):
+        import builtins
+        import opp.web.app as web
+
+        web.state(app).load()
+
+        def no_open(*args, **kwargs):
+            raise AssertionError("file opened")
+
+        monkeypatch.setattr(builtins, "open", no_open)
+        response = client.head(self.url(episode))
+        monkeypatch.undo()
+
+        assert response.status_code == 200
+        assert response.content_length == episode.path.stat().st_size
+        assert response.mimetype.startswith("audio/")
+
+    def test_single_range(self, client, episode):
+        data = episode.path.read_bytes()
+
+        response = client.get(self.url(episode), headers={"Range": "bytes=10-19"})
+
+        assert response.status_code == 206
+        assert response.get_data() == data[10:20]
+        assert response.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+
+        response = client.get(self.url(episode), headers={"Range": "bytes=-5"})
+        assert response.get_data() == data[-5:]
+
+    def test_multiple_ranges(self, client, episode):
+        data = episode.path.read_bytes()
+
+        response = client.get(self.url(episode), headers={"Range": "bytes=0-3,100-109"})
+        body = response.get_data()
+
+        assert response.status_code == 206
+        assert response.mimetype == "multipart/byteranges"
+        assert response.content_length == len(body)
+
+        boundary = response.mimetype_params["boundary"]
+        parts = body.split(f"--{boundary}".encode("ascii"))
+
+        assert parts[1].endswith(b"\r\n\r\n" + data[0:4] + b"\r\n")
+        assert f"Content-Range: bytes 100-109/{len(data)}".encode("ascii") in parts[2]
+        assert parts[2].endswith(b"\r\n\r\n" + data[100:110] + b"\r\n")
+        assert parts[3] == b"--\r\n"
+
+    def test_unsatisfiable_range(self, client, episode):
+        length = episode.path.stat().st_size
+        response = client.get(self.url(episode), headers={"Range": f"bytes={length + 10}-"})
+
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == f"bytes */{length}"
+
+    def test_if_range_mismatch(self, client, episode):
+        response = client.get(self.url(episode), headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+
+        assert response.status_code == 200
+        assert response.get_data() == episode.path.read_bytes()
+
+
+class TestCompression:
+
+    @pytest.mark.parametrize("url", ["/", "/rss.xml"])
+    def test_gzip(self, client, url):
+        import gzip
+
+        plain = client.get(url)
+        compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in plain.headers
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(compressed.data) == plain.data
+
+        for response in [plain, compressed]:
+            assert "Accept-Encoding" in response.headers["Vary"]
+
+        assert compressed.headers["ETag"] != plain.headers["ETag"]
+
+    def test_not_modified(self, client):
+        etag = client.get("/rss.xml", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+
+        assert client.get("/rss.xml", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+        assert client.get("/rss.xml", headers={"If-None-Match": etag}).status_code == 200
+
+    def test_refused(self, client):
+        response = client.get("/rss.xml", headers={"Accept-Encoding": "gzip;q=0, identity"})
+        assert "Content-Encoding" not in response.headers
+
+    def test_brotli(self, client):
+        brotli = pytest.importorskip("brotli")
+
+        plain = client.get("/rss.xml")
+        compressed = client.get("/rss.xml", headers={"Accept-Encoding": "gzip, br"})
+
+        assert compressed.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(compressed.data) == plain.data
+
+
+class TestAsyncServer:
+
+    @pytest.fixture
+    def server(self, app):
+        import asyncio
+        import threading
+        import opp.web.aio as aio
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(aio.start("127.0.0.1", 0, app))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        yield server.sockets[0].getsockname()[:2]
+
+        async def shutdown():
+            server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def request(self, server, method, url, headers={}):
+        import http.client
+
+        connection = http.client.HTTPConnection(*server, timeout=5)
+        connection.request(method, url, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+
+        return response, body
+
+    def test_episode(self, server, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+        data = episode.path.read_bytes()
+
+        response, body = self.request(server, "GET", f"/episode/{episode.guid}.mp3")
+
+        assert response.status == 200
+        assert body == data
+        assert response.getheader("ETag") == f'"{episode.guid}"'
+        assert "immutable" in response.getheader("Cache-Control")
+
+    def test_episode_range(self, server, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+        data = episode.path.read_bytes()
+
+        response, body = self.request(server, "GET", f"/episode/{episode.guid}.mp3", {"Range": "bytes=100-"})
+
+        assert response.status == 206
+        assert body == data[100:]
+        assert response.getheader("Content-Range") == f"bytes 100-{len(data) - 1}/{len(data)}"
+
+    def test_episode_head(self, server, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+
+        response, body = self.request(server, "HEAD", f"/episode/{episode.guid}.mp3")
+
+        assert response.status == 200
+        assert int(response.getheader("Content-Length")) == episode.path.stat().st_size
+        assert body == b""
+
+    def test_missing_episode(self, server):
+        response, body = self.request(server, "GET", "/episode/eb8766d0-ea67-4de4-bdb5-ef279fe7efb4.mp3")
+        assert response.status == 404
+
+    def test_deleted_audio(self, server, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+        episode.path.unlink()
+
+        response, body = self.request(server, "GET", f"/episode/{episode.guid}.mp3")
+        assert response.status == 404
+
+        response, body = self.request(server, "GET", "/")
+        assert response.status == 200
+
+    def test_lookup_off_loop(self, server, app, admin_ds, monkeypatch):
+        import asyncio
+        import opp.web.app as web
+
+        episode = admin_ds.get_episodes()[0]
+        visit_podcast = web.state(app).visit_podcast
+        get_episode = visit_podcast.get_episode
+        on_loop = []
+
+        def recording(guid):
+            on_loop.append(asyncio._get_running_loop() is not None)
+            return get_episode(guid)
+
+        monkeypatch.setattr(visit_podcast, "get_episode", recording)
+
+        assert self.request(server, "HEAD", f"/episode/{episode.guid}.mp3")[0].status == 200
+        assert on_loop == [False]
+
+    def test_pages(self, server, client):
+        response, body = self.request(server, "GET", "/rss.xml", {"Host": "podcast.example.com"})
+
+        assert response.status == 200
+        assert body == client.get("/rss.xml", base_url="http://podcast.example.com").data
+
+        response, body = self.request(server, "GET", "/?page=1")
+        assert response.status == 200
+
+    def test_keep_alive(self, server, admin_ds):
+        import http.client
+
+        episode = admin_ds.get_episodes()[0]
+        connection = http.client.HTTPConnection(*server, timeout=5)
+
+        for url in [f"/episode/{episode.guid}.mp3", "/rss.xml", f"/episode/{episode.guid}.mp3"]:
+            connection.request("GET", url)
+            response = connection.getresponse()
+            response.read()
+
+            assert response.status == 200
+
+        connection.close()
+
+
+class TestMetrics:
+
+    def test_endpoint(self, client, admin_ds):
+        episode = admin_ds.get_episodes()[0]
+
+        client.get("/rss.xml")
+        client.get(f"/episode/{episode.guid}.mp3", headers={"Range": "bytes=0-99"})
+
+        response = client.get("/metrics")
+        text = response.get_data(as_text=True)
+
+        assert response.mimetype == "text/plain"
+        assert 'opp_requests_total{route="rss",method="GET",status="200"}' in text
+        assert 'opp_request_duration_seconds_bucket{route="rss",le="+Inf"}' in text
+        assert f'opp_episode_bytes_total{{guid="{episode.guid}"}}' in text
+        assert 'opp_datastore_calls_total{operation="get_episode"}' in text
+
+    def test_separate_port(self, client, monkeypatch):
+        monkeypatch.setenv("OPP_METRICS_PORT", "9999")
+        assert client.get("/metrics").status_code == 404
+
+    def test_shards(self):
+        import threading
+        from opp.web.metrics import Metrics
+
+        metrics = Metrics(buckets=(0.1, 1.0))
+
+        def work():
+            for i in range(1000):
+                metrics.count("hits", (("route", "home"),))
+                metrics.observe("latency", (("route", "home"),), 0.5)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        metrics.describe("hits", "counter", "Hits.")
+        text = metrics.render()
+
+        assert "# TYPE hits counter" in text
+        assert 'hits{route="home"} 4000' in text
+        assert 'latency_bucket{route="home",le="0.1"} 0' in text
+        assert 'latency_bucket{route="home",le="1.0"} 4000' in text
+        assert 'latency_count{route="home"} 4000' in text
+
+    def test_short_lived_threads(self):
+        import threading
+        from opp.web.metrics import Metrics
+
+        metrics = Metrics(buckets=(0.1, 1.0))
+
+        def work():
+            metrics.count("hits")
+            metrics.observe("latency", (), 0.5)
+
+        # As a server starting a thread per request does.
+        for batch in range(40):
+            threads = [threading.Thread(target=work) for i in range(50)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        assert len(metrics._shards) < 200
+
+        counters, histograms = metrics.collect()
+
+        assert len(metrics._shards) == 0
+        assert counters[("hits", ())] == 2000
+        assert histograms[("latency", ())] == [0, 2000, 1000.0, 2000]
+
+    def test_serve_in_background(self):
+        import urllib.request
+        from opp.web.metrics import Metrics, serve_in_background
+
+        metrics = Metrics()
+        metrics.count("hits")
+        server = serve_in_background(metrics, "127.0.0.1", 0)
+
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5) as response:
+                assert response.read() == b"hits 1\n"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestProfiling:
+
+    @pytest.mark.parametrize("value, threshold", [(None, None), ("", None), ("all", 0.0), ("slow:200ms", 0.2), ("slow:1.5s", 1.5), ("slow:2", 2.0)])
+    def test_setting(self, value, threshold):
+        from opp.profiling import parse_setting
+        assert parse_setting(value) == threshold
+
+    def test_bad_setting(self):
+        from opp.profiling import parse_setting
+
+        with pytest.raises(ValueError):
+            parse_setting("fast")
+
+    def client(self):
+        import opp.web.app as web
+        return web.create_app().test_client()
+
+    def test_slow_request(self, admin_ds, monkeypatch, tmp_path):
+        import json
+        import pstats
+
+        monkeypatch.setenv("OPP_PROFILE", "all")
+        monkeypatch.setenv("OPP_PROFILE_DIR", str(tmp_path / "profiles"))
+
+        self.client().get("/rss.xml?x=1")
+
+        [details] = (tmp_path / "profiles").glob("*-web-rss-*.json")
+        description = json.loads(details.read_text())
+
+        assert description["route"] == "rss"
+        assert description["path"] == "/rss.xml?x=1"
+        assert description["episodes"] == 3
+
+        pstats.Stats(str(details.with_suffix(".prof")))
+
+    def test_fast_request(self, admin_ds, monkeypatch, tmp_path):
+        monkeypatch.setenv("OPP_PROFILE", "slow:60s")
+        monkeypatch.setenv("OPP_PROFILE_DIR", str(tmp_path / "profiles"))
+
+        assert self.client().get("/rss.xml").status_code == 200
+        assert not (tmp_path / "profiles").exists()
+
+    def test_bad_setting_at_startup(self, admin_ds, monkeypatch):
+        monkeypatch.setenv("OPP_PROFILE", "fast")
+
+        with pytest.raises(ValueError):
+            self.client()
+
+
+class TestAppFactory:
+
+    # Generous for a loaded CI machine; importing flask accounts for most of it.
+    STARTUP_BUDGET = 2.0
+
+    def test_startup(self, tmp_path):
+        import json
+        import subprocess
+        import sys
+
+        script = """
+import json, sys, time
+start = time.perf_counter()
+import opp.web.app as web
+web.create_app()
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "modules": [name for name in ("markdown2", "opp.administrator", "opp.datastore.sqlite") if name in sys.modules],
+}))
+"""
+        # No catalog exists in tmp_path, so creating the app must not try to read one.
+        env = {"PATH": "", "HOME": str(tmp_path), "OPP": str(tmp_path / "missing"), "PYTHONPATH": ":".join(sys.path)}
+        output = subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True, text=True).stdout
+        startup = json.loads(output)
+
+        assert startup["modules"] == []
+        assert startup["seconds"] < self.STARTUP_BUDGET
+
+    @pytest.mark.parametrize("preload, loads", [(False, 0), (True, 1)])
+    def test_preload(self, admin_ds, monkeypatch, preload, loads):
+        import opp.web.app as web
+
+        calls = []
+        visit_podcast = config.visit_podcast
+        monkeypatch.setattr(config, "visit_podcast", lambda: calls.append(1) or visit_podcast())
+
+        app = web.create_app(preload=preload)
+        assert len(calls) == loads
+
+        assert app.test_client().get("/").status_code == 200
+        assert len(calls) == 1
+
+    def test_separate_state(self, admin_ds):
+        import opp.web.app as web
+
+        first, second = web.create_app(), web.create_app()
+        first.test_client().get("/")
+        version = web.state(first).visit_podcast.catalog_version()
+
+        assert web.state(first).rendered_pages.has_version(version)
+        assert not web.state(second).rendered_pages.has_version(version)
+
+
+class TestTenants:
+
+    @pytest.fixture
+    def root(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("OPP_RELOAD_INTERVAL", "0")
+
+        for name, episodes in [("one", 2), ("two", 3)]:
+            initialize_admin_ds(jsf.AdminDS(tmp_path / "tenants" / name), episodes=episodes)
+
+        return tmp_path / "tenants"
+
+    def client(self, tenants):
+        from werkzeug.test import Client
+        return Client(tenants)
+
+    def title(self, root, name):
+        from markupsafe import escape
+        return str(escape(jsf.AdminDS(root / name).get_channel().title))
+
+    def test_path_routing(self, root):
+        from opp.web.tenants import Tenants
+
+        client = self.client(Tenants(root))
+        one = client.get("/one/")
+        feed = client.get("/two/rss.xml")
+
+        assert one.status_code == 200
+        assert self.title(root, "one") in one.get_data(as_text=True)
+        assert 'href="/one/rss.xml"' in one.get_data(as_text=True)
+        assert self.title(root, "two") in feed.get_data(as_text=True)
+        assert feed.get_data(as_text=True).count("<item>") == 3
+
+        redirect = client.get("/one?page=1")
+        assert redirect.status_code == 308
+        assert redirect.headers["Location"].endswith("/one/?page=1")
+
+        for missing in ["/three/", "/../one/", "/.hidden/", "/"]:
+            assert client.get(missing).status_code == 404
+
+    def test_host_routing(self, root):
+        from opp.web.tenants import Tenants
+
+        client = self.client(Tenants(root, routing="host"))
+        response = client.get("/", headers={"Host": "Two:8000"})
+
+        assert self.title(root, "two") in response.get_data(as_text=True)
+        assert client.get("/", headers={"Host": "three"}).status_code == 404
+
+    def test_episode(self, root):
+        from opp.web.tenants import Tenants
+
+        client = self.client(Tenants(root))
+        episode = jsf.AdminDS(root / "one").get_episodes()[0]
+
+        assert client.get(f"/one/episode/{episode.guid}.mp3").status_code == 200
+        assert client.get(f"/two/episode/{episode.guid}.mp3").status_code == 404
+
+    def test_separate_caches(self, root):
+        import opp.web.app as web
+        from opp.web.tenants import Tenants
+
+        tenants = Tenants(root)
+        self.client(tenants).get("/one/rss.xml")
+        one, two = web.state(tenants.app("one")), web.state(tenants.app("two"))
+
+        assert one.rendered_pages.has_version(one.visit_podcast.catalog_version())
+        assert not two.rendered_pages.has_version(two.visit_podcast.catalog_version())
+
+    def test_least_recently_used(self, root):
+        from opp.web.tenants import Tenants
+
+        tenants = Tenants(root, max_loaded=1)
+        client = self.client(tenants)
+
+        client.get("/one/")
+        first = tenants.app("one")
+        client.get("/two/")
+
+        assert tenants.loaded() == ["two"]
+        assert client.get("/one/").status_code == 200
+        assert tenants.app("one") is not first
+
+    def test_idle(self, root, monkeypatch):
+        import time
+        from opp.web.tenants import Tenants
+
+        now = [1000.0]
+        monkeypatch.setattr(time, "monotonic", lambda: now[0])
+        tenants = Tenants(root, idle=60)
+        client = self.client(tenants)
+
+        client.get("/one/")
+        now[0] += 30
+        client.get("/two/")
+        assert tenants.loaded() == ["one", "two"]
+
+        now[0] += 45
+        client.get("/two/")
+        assert tenants.loaded() == ["two"]
+
+    def test_settings(self, root, monkeypatch):
+        from opp.web.tenants import create_tenants
+
+        monkeypatch.setenv("OPP_TENANTS", str(root))
+        monkeypatch.setenv("OPP_TENANT_ROUTING", "host")
+        monkeypatch.setenv("OPP_TENANT_CACHE", "4")
+        tenants = create_tenants()
+
+        assert (tenants.routing, tenants.max_loaded, tenants.idle) == ("host", 4, 600)
+
+        monkeypatch.setenv("OPP_TENANT_ROUTING", "cookie")
+
+        with pytest.raises(ValueError):
+            create_tenants()
+
+    def test_tenant_config(self, root, monkeypatch):
+        monkeypatch.delenv("OPP_PROFILE_DIR", raising=False)
+        tenant = config.TenantConfig(root / "one")
+
+        assert tenant.datastore_dir() == root / "one"
+        assert tenant.css_file() == root / "one/web/style.css"
+        assert tenant.profile_dir() == root / "one/profiles"
+        assert tenant.page_size() == config.page_size()
+        assert tenant.visit_podcast().episode_count() == 2
+
+    def test_no_metrics(self, root):
+        from opp.web.tenants import Tenants
+
+        assert self.client(Tenants(root)).get("/one/metrics").status_code == 404